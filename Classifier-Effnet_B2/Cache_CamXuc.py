@@ -0,0 +1,137 @@
+import os
+import json
+import shutil
+import hashlib
+import argparse
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+from PIL import Image
+from tqdm import tqdm
+from Dataset_CamXuc import CamXuc_dataset
+
+
+# cache được lưu theo từng split:
+#   <cache_path>/<train|valid>/index.json     khóa (fingerprint), image_size, số ảnh, danh sách shard
+#   <cache_path>/<train|valid>/labels.npy
+#   <cache_path>/<train|valid>/shard_000.npy  uint8 (n, 3, image_size, image_size), mở bằng memmap
+
+
+def fingerprint(dataset, image_size):
+    # đổi file ảnh (thêm / xóa / sửa) hoặc đổi image_size -> khóa khác -> tự build lại cache
+    h = hashlib.sha1(f"{image_size}".encode())
+    for path, label in zip(dataset.image_paths, dataset.labels):
+        stat = os.stat(path)
+        h.update(f"{path}|{label}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+class _DecodeResize:
+    # decode + resize giống transforms.Resize((s, s)) trên PIL, trả về uint8 CHW
+    def __init__(self, image_size):
+        self.image_size = image_size
+
+    def __call__(self, image):
+        image = image.resize((self.image_size, self.image_size), Image.BILINEAR)
+        return np.ascontiguousarray(np.asarray(image, dtype=np.uint8).transpose(2, 0, 1))
+
+
+def read_index(split_dir):
+    index_path = os.path.join(split_dir, "index.json")
+    if not os.path.isfile(index_path):
+        return None
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def build_cache(root, is_train, cache_path, image_size, shard_size=4096, num_workers=4):
+    dataset = CamXuc_dataset(root=root, is_train=is_train, transforms=_DecodeResize(image_size))
+    split_dir = os.path.join(cache_path, "train" if is_train else "valid")
+    key = fingerprint(dataset, image_size)
+    index = read_index(split_dir)
+    if index is not None and index["key"] == key:
+        return split_dir
+
+    print(f"🔨 Build cache {split_dir} ({len(dataset)} ảnh, {image_size}x{image_size})")
+    if os.path.exists(split_dir):
+        shutil.rmtree(split_dir)
+    os.makedirs(split_dir)
+
+    shards = []
+    for start in range(0, len(dataset), shard_size):
+        count = min(shard_size, len(dataset) - start)
+        name = f"shard_{len(shards):03d}.npy"
+        shard = np.lib.format.open_memmap(os.path.join(split_dir, name), mode="w+", dtype=np.uint8,
+                                          shape=(count, 3, image_size, image_size))
+        subset = torch.utils.data.Subset(dataset, range(start, start + count))
+        loader = DataLoader(subset, batch_size=64, shuffle=False, num_workers=num_workers)
+        offset = 0
+        for images, _ in tqdm(loader, desc=name):
+            shard[offset:offset + len(images)] = images.numpy()
+            offset += len(images)
+        shard.flush()
+        del shard
+        shards.append({"file": name, "count": count})
+
+    np.save(os.path.join(split_dir, "labels.npy"), np.asarray(dataset.labels, dtype=np.int64))
+    # index.json ghi cuối cùng: build bị ngắt giữa chừng thì lần sau sẽ build lại
+    with open(os.path.join(split_dir, "index.json"), "w") as f:
+        json.dump({"key": key, "image_size": image_size, "count": len(dataset),
+                   "shard_size": shard_size, "shards": shards, "categories": dataset.categories}, f, indent=2)
+    return split_dir
+
+
+def open_cache(root, is_train, cache_path, image_size):
+    # chỉ mở cache đã build sẵn, không bao giờ ghi -> dùng cho các process DDP không được phân công build
+    dataset = CamXuc_dataset(root=root, is_train=is_train)
+    split_dir = os.path.join(cache_path, "train" if is_train else "valid")
+    index = read_index(split_dir)
+    if index is None:
+        raise FileNotFoundError(f"Không có {os.path.join(split_dir, 'index.json')}: cache chưa được build")
+    if index["key"] != fingerprint(dataset, image_size):
+        raise RuntimeError(f"Cache {split_dir} không khớp dữ liệu / image_size hiện tại, cần build lại")
+    return split_dir
+
+
+class CamXuc_cached_dataset(Dataset):
+    # giống CamXuc_dataset nhưng đọc ảnh đã decode + resize sẵn từ memmap
+    # __getitem__ trả về tensor uint8 (3, H, W) trỏ thẳng vào file (zero-copy) -> transforms phải nhận tensor,
+    # ví dụ ConvertImageDtype + Normalize, và có thể thêm augmentation ngẫu nhiên dạng tensor (RandomHorizontalFlip, ...)
+    # build=False: chỉ mở cache có sẵn, báo lỗi nếu thiếu hoặc cũ (thay vì tự build lại)
+    def __init__(self, root, is_train, cache_path, image_size, transforms=None, num_workers=4, build=True):
+        if build:
+            self.split_dir = build_cache(root, is_train, cache_path, image_size, num_workers=num_workers)
+        else:
+            self.split_dir = open_cache(root, is_train, cache_path, image_size)
+        index = read_index(self.split_dir)
+        self.categories = index["categories"]
+        self.shard_files = [os.path.join(self.split_dir, shard["file"]) for shard in index["shards"]]
+        self.shard_size = index["shard_size"]
+        self.labels = np.load(os.path.join(self.split_dir, "labels.npy")).tolist()
+        self.transforms = transforms
+        self.shards = None  # mở memmap lười trong từng worker của DataLoader, tránh pickle cả mảng
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        if self.shards is None:
+            # mode "c" (copy-on-write): tensor ghi được mà không bao giờ sửa file cache
+            self.shards = [np.load(path, mmap_mode="c") for path in self.shard_files]
+        image = torch.from_numpy(self.shards[index // self.shard_size][index % self.shard_size])
+        label = self.labels[index]
+        if self.transforms:
+            image = self.transforms(image)
+        return image, label
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build trước cache ảnh đã decode cho CamXuc_dataset")
+    parser.add_argument("--data_path", type=str, default="C:/Hoc_May/All_Project/Predict_CamXuc/dataset_classification")
+    parser.add_argument("--cache_path", type=str, default="C:/Hoc_May/All_Project/Predict_CamXuc/dataset_cache")
+    parser.add_argument("--image_size", type=int, default=260)
+    parser.add_argument("--shard_size", type=int, default=4096)
+    parser.add_argument("--num_workers", type=int, default=4)
+    args = parser.parse_args()
+    for is_train in (True, False):
+        build_cache(args.data_path, is_train, args.cache_path, args.image_size, args.shard_size, args.num_workers)
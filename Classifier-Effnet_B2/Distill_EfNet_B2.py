@@ -0,0 +1,170 @@
+import os
+import json
+import argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset, DataLoader
+from torch.utils.tensorboard import SummaryWriter
+from tqdm import tqdm
+from Dataset_CamXuc import CamXuc_dataset
+from Cache_CamXuc import fingerprint
+from Model_CamXuc import STUDENT_SIZES, make_transform, build_student, load_effnet_b2, latency_ms
+
+
+# 1. chạy teacher (best.pt EfficientNet-B2) 1 lần trên tập train, lưu logits float16 theo vị trí trong image_paths
+# 2. train student nhỏ ở độ phân giải thấp hơn với loss KD đọc logits từ cache -> teacher không chạy lại mỗi epoch
+# 3. so sánh accuracy / latency student với teacher
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Knowledge distillation EfficientNet-B2 -> student nhỏ chạy realtime trên CPU")
+    parser.add_argument("--data_path", type=str, default="C:/Hoc_May/All_Project/Predict_CamXuc/dataset_classification")
+    parser.add_argument("--teacher", type=str, default="C:/Hoc_May/All_Project/Predict_CamXuc/EfNet_checkpoint/efficientnet_b2/best.pt")
+    parser.add_argument("--teacher_size", type=int, default=260)
+    parser.add_argument("--logits_path", type=str, default="C:/Hoc_May/All_Project/Predict_CamXuc/EfNet_checkpoint/teacher_logits")
+    parser.add_argument("--student", type=str, default="mobilenet_v3_small", choices=list(STUDENT_SIZES))
+    parser.add_argument("--image_size", type=int, default=None)  # mặc định theo student: 160 / 224
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.7)  # trọng số loss KD, (1 - alpha) cho cross-entropy với nhãn thật
+    parser.add_argument("--num_workers", type=int, default=4)
+    parser.add_argument("--log_path", type=str, default="C:/Hoc_May/All_Project/Predict_CamXuc/EfNet_tensorboard/Distill")
+    parser.add_argument("--checkpoint_path", type=str, default="C:/Hoc_May/All_Project/Predict_CamXuc/EfNet_checkpoint/student")
+    return parser.parse_args()
+
+
+# === Cache logits của teacher ===
+def cache_teacher_logits(args, device):
+    dataset = CamXuc_dataset(root=args.data_path, is_train=True, transforms=make_transform(args.teacher_size))
+    logits_file = os.path.join(args.logits_path, "train_logits.npy")
+    meta_file = os.path.join(args.logits_path, "meta.json")
+    # cùng khóa với cache ảnh (đường dẫn, nhãn, kích thước, mtime từng file) + checkpoint teacher
+    key = {"data": fingerprint(dataset, args.teacher_size), "teacher": os.path.abspath(args.teacher),
+           "teacher_mtime": os.path.getmtime(args.teacher)}
+    if os.path.isfile(meta_file) and os.path.isfile(logits_file):
+        with open(meta_file) as f:
+            if json.load(f) == key:
+                return np.load(logits_file, mmap_mode="r")
+
+    os.makedirs(args.logits_path, exist_ok=True)
+    teacher = load_effnet_b2(args.teacher, device)
+    logits = np.lib.format.open_memmap(logits_file, mode="w+", dtype=np.float16, shape=(len(dataset), 8))
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
+    offset = 0
+    with torch.no_grad():
+        for images, _ in tqdm(loader, desc="Teacher logits"):
+            outputs = teacher(images.to(device)).float().cpu().numpy()
+            logits[offset:offset + len(outputs)] = outputs
+            offset += len(outputs)
+    logits.flush()
+    with open(meta_file, "w") as f:
+        json.dump(key, f, indent=2)
+    return np.load(logits_file, mmap_mode="r")
+
+
+class IndexedDataset(Dataset):
+    # trả thêm chỉ số ảnh (vị trí trong image_paths) để lấy đúng logits của teacher
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        image, label = self.dataset[index]
+        return image, label, index
+
+
+def kd_loss(student_logits, teacher_logits, labels, temperature, alpha):
+    soft = F.kl_div(F.log_softmax(student_logits / temperature, dim=1),
+                    F.softmax(teacher_logits / temperature, dim=1), reduction="batchmean") * temperature ** 2
+    hard = F.cross_entropy(student_logits, labels, label_smoothing=0.1)
+    return alpha * soft + (1 - alpha) * hard
+
+
+def evaluate(model, loader, device):
+    correct = total = 0
+    with torch.no_grad():
+        for images, labels in loader:
+            preds = torch.argmax(model(images.to(device)), dim=1).cpu()
+            correct += (preds == labels).sum().item()
+            total += labels.size(0)
+    return correct / total
+
+
+def compare_report(args, student, teacher, image_size, device):
+    val_student = DataLoader(CamXuc_dataset(root=args.data_path, is_train=False, transforms=make_transform(image_size)),
+                             batch_size=args.batch_size, num_workers=args.num_workers)
+    val_teacher = DataLoader(CamXuc_dataset(root=args.data_path, is_train=False, transforms=make_transform(args.teacher_size)),
+                             batch_size=args.batch_size, num_workers=args.num_workers)
+    report = {"teacher": {"arch": "effnet_b2", "image_size": args.teacher_size,
+                          "accuracy": evaluate(teacher, val_teacher, device)},
+              "student": {"arch": args.student, "image_size": image_size,
+                          "accuracy": evaluate(student, val_student, device)}}
+    student_cpu, teacher_cpu = student.cpu().eval(), teacher.cpu().eval()
+    for batch_size in (1, 8):
+        report["teacher"][f"cpu_ms_batch{batch_size}"] = latency_ms(teacher_cpu, args.teacher_size, batch_size)
+        report["student"][f"cpu_ms_batch{batch_size}"] = latency_ms(student_cpu, image_size, batch_size)
+    for name, r in report.items():
+        print(f"{name:<8} {r['arch']:<20} {r['image_size']}px | Acc: {r['accuracy']:.4f} | "
+              f"CPU: {r['cpu_ms_batch1']:.1f} ms (batch 1), {r['cpu_ms_batch8']:.1f} ms (batch 8)")
+    with open(os.path.join(args.checkpoint_path, "distill_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def train(args):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    image_size = args.image_size or STUDENT_SIZES[args.student]
+    teacher_logits = torch.from_numpy(np.asarray(cache_teacher_logits(args, device), dtype=np.float32))
+
+    train_dataset = CamXuc_dataset(root=args.data_path, is_train=True, transforms=make_transform(image_size))
+    val_dataset = CamXuc_dataset(root=args.data_path, is_train=False, transforms=make_transform(image_size))
+    train_loader = DataLoader(IndexedDataset(train_dataset), batch_size=args.batch_size, shuffle=True,
+                              num_workers=args.num_workers)
+    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
+
+    student = build_student(args.student, weights="DEFAULT").to(device)
+    optimizer = torch.optim.Adam(student.parameters(), lr=args.lr)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
+    os.makedirs(args.checkpoint_path, exist_ok=True)
+    writer = SummaryWriter(args.log_path)
+    best_accuracy = 0
+
+    for epoch in range(args.epochs):
+        student.train()
+        progress_bar = tqdm(train_loader, desc=f"Epoch {epoch}/{args.epochs}")
+        for images, labels, indices in progress_bar:
+            images, labels = images.to(device), labels.to(device)
+            loss = kd_loss(student(images), teacher_logits[indices].to(device), labels, args.temperature, args.alpha)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+        scheduler.step()
+
+        student.eval()
+        val_acc = evaluate(student, val_loader, device)
+        writer.add_scalar("Val/Accuracy", val_acc, epoch)
+        print(f"[Epoch {epoch}] Val Acc: {val_acc:.4f}")
+
+        # lưu kèm arch + image_size để script nhận diện dựng đúng student (--classifier)
+        checkpoint = {
+            "epoch": epoch,
+            "arch": args.student,
+            "image_size": image_size,
+            "model_state_dict": student.state_dict(),
+            "optimizer_state_dict": optimizer.state_dict()
+        }
+        torch.save(checkpoint, os.path.join(args.checkpoint_path, "last.pt"))
+        if val_acc > best_accuracy:
+            best_accuracy = val_acc
+            torch.save(checkpoint, os.path.join(args.checkpoint_path, "best.pt"))
+
+    student.load_state_dict(torch.load(os.path.join(args.checkpoint_path, "best.pt"), map_location=device)["model_state_dict"])
+    compare_report(args, student.eval(), load_effnet_b2(args.teacher, device), image_size, device)
+
+
+if __name__ == "__main__":
+    train(get_args())
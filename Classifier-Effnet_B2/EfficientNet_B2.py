@@ -3,16 +3,24 @@ import torch.nn as nn
 import os
 import numpy as np
 from torchvision import transforms
-from torchvision.models import efficientnet_b2, EfficientNet_B2_Weights
-from torch.utils.data import DataLoader
+from torchvision.models import EfficientNet_B2_Weights
+from torch.utils.data import DataLoader, Subset
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
+import torch.distributed as dist
+from contextlib import nullcontext
 from torch.utils.tensorboard import SummaryWriter
 from torch.optim.lr_scheduler import ReduceLROnPlateau
-from sklearn.metrics import accuracy_score, confusion_matrix
 from tqdm import tqdm
 import argparse
+import time
 import shutil
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from Dataset_CamXuc import CamXuc_dataset
+from Cache_CamXuc import CamXuc_cached_dataset, build_cache
+from Writer_CamXuc import AsyncWriter
+from Model_CamXuc import MEAN, STD, make_transform, build_effnet_b2
 
 def get_args():
     parser = argparse.ArgumentParser()
@@ -25,45 +33,116 @@ def get_args():
     parser.add_argument("--checkpoint_path", type=str, default="C:/Hoc_May/All_Project/Predict_CamXuc/EfNet_checkpoint/efficientnet_b2")
     parser.add_argument("--resume", type=str, default=None)
     parser.add_argument("--start_epoch", type=int, default=0)
-    return parser.parse_args([])
+    parser.add_argument("--cache_path", type=str, default=None)  # thư mục cache ảnh đã decode (memmap), None = đọc ảnh gốc
+    parser.add_argument("--shared_cache", action="store_true")  # DDP nhiều máy: --cache_path nằm trên ổ dùng chung, chỉ rank 0 build
+    # === Chế độ hiệu năng ===
+    parser.add_argument("--amp", type=str, default="none", choices=["none", "bf16", "fp16"])  # autocast, bf16 chạy được cả trên CPU
+    parser.add_argument("--channels_last", action="store_true")
+    parser.add_argument("--compile", action="store_true")  # torch.compile
+    parser.add_argument("--accum_steps", type=int, default=1)  # gradient accumulation
+    parser.add_argument("--log_every", type=int, default=50)  # chỉ đọc loss/throughput về host mỗi N step
+    parser.add_argument("--num_workers", type=int, default=4)
+    # === Ghi log / checkpoint ở thread nền ===
+    parser.add_argument("--figure_every", type=int, default=1)  # vẽ confusion matrix mỗi K epoch (luôn vẽ ở epoch cuối)
+    parser.add_argument("--save_every", type=int, default=1)    # ghi last.pt mỗi K epoch (best.pt và epoch cuối luôn ghi)
+    parser.add_argument("--keep_last", type=int, default=0)     # giữ thêm N checkpoint epoch_XXX.pt gần nhất, 0 = tắt
+    # === Huấn luyện phân tán: chạy bằng torchrun, --batch_size là batch của mỗi process ===
+    parser.add_argument("--dist_backend", type=str, default="gloo", choices=["gloo", "nccl"])  # gloo chạy được trên CPU
+    return parser.parse_args()
 
-def plot_confusion_matrix(writer, cm, class_names, epoch):
-    figure = plt.figure(figsize=(20, 20))
-    plt.imshow(cm, interpolation='nearest', cmap="cool")
-    plt.title("Confusion matrix")
-    plt.colorbar()
+def plot_confusion_matrix(cm, class_names):
+    # Figure (backend Agg) thay cho pyplot: không dùng trạng thái toàn cục -> vẽ được ở thread nền
+    figure = Figure(figsize=(20, 20))
+    FigureCanvasAgg(figure)
+    ax = figure.subplots()
+    image = ax.imshow(cm, interpolation='nearest', cmap="cool")
+    ax.set_title("Confusion matrix")
+    figure.colorbar(image, ax=ax)
     tick_marks = np.arange(len(class_names))
-    plt.xticks(tick_marks, class_names, rotation=45)
-    plt.yticks(tick_marks, class_names)
-    cm = np.around(cm.astype('float') / cm.sum(axis=1)[:, np.newaxis], decimals=2)
+    ax.set_xticks(tick_marks)
+    ax.set_xticklabels(class_names, rotation=45)
+    ax.set_yticks(tick_marks)
+    ax.set_yticklabels(class_names)
+    cm = np.around(cm.astype('float') / np.maximum(cm.sum(axis=1)[:, np.newaxis], 1), decimals=2)
     threshold = cm.max() / 2.
     for i in range(cm.shape[0]):
         for j in range(cm.shape[1]):
             color = "white" if cm[i, j] > threshold else "black"
-            plt.text(j, i, cm[i, j], horizontalalignment="center", color=color)
-    plt.tight_layout()
-    plt.ylabel('True label')
-    plt.xlabel('Predicted label')
-    writer.add_figure('confusion_matrix', figure, epoch)
+            ax.text(j, i, cm[i, j], horizontalalignment="center", color=color)
+    ax.set_ylabel('True label')
+    ax.set_xlabel('Predicted label')
+    figure.tight_layout()
+    return figure
+
+def setup_distributed(args):
+    # torchrun đặt WORLD_SIZE / RANK / LOCAL_RANK; chạy python thường thì world_size = 1
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size > 1:
+        dist.init_process_group(backend=args.dist_backend)
+    rank = int(os.environ.get("RANK", 0))
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    if torch.cuda.is_available():
+        torch.cuda.set_device(local_rank)
+        device = torch.device("cuda", local_rank)
+    else:
+        device = torch.device("cpu")
+    return device, rank, world_size
+
+def all_reduce(*tensors):
+    if dist.is_initialized():
+        for tensor in tensors:
+            dist.all_reduce(tensor)
 
 def train(args):
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    device, rank, world_size = setup_distributed(args)
+    distributed = world_size > 1
+    is_main = rank == 0
 
-    model = efficientnet_b2(weights=EfficientNet_B2_Weights.DEFAULT)
-    model.classifier[1] = nn.Linear(model.classifier[1].in_features, 8)
+    model = build_effnet_b2(weights=EfficientNet_B2_Weights.DEFAULT)
     model.to(device)
+    memory_format = torch.channels_last if args.channels_last else torch.contiguous_format
+    model.to(memory_format=memory_format)
+    # model gốc giữ để lưu state_dict (không có tiền tố module. / _orig_mod.) -> resume được với mọi world size
+    ddp_model = DistributedDataParallel(model, device_ids=[device.index] if device.type == "cuda" else None) if distributed else model
+    train_model = torch.compile(ddp_model) if args.compile else ddp_model
+    # validation chạy trên model gốc (không qua DDP) vì mỗi rank có số batch khác nhau
+    eval_model = (torch.compile(model) if args.compile else model) if distributed else train_model
+    amp_dtype = {"bf16": torch.bfloat16, "fp16": torch.float16}.get(args.amp)
+    scaler = torch.cuda.amp.GradScaler(enabled=args.amp == "fp16" and device.type == "cuda")
 
-    transform = transforms.Compose([
-        transforms.Resize((args.image_size, args.image_size)),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-    ])
+    transform = make_transform(args.image_size)
 
-    train_dataset = CamXuc_dataset(root=args.data_path, is_train=True, transforms=transform)
-    val_dataset = CamXuc_dataset(root=args.data_path, is_train=False, transforms=transform)
+    if args.cache_path:
+        # mỗi thư mục cache chỉ 1 process build (xóa + ghi lại thư mục shard), các process khác chờ rồi chỉ mở:
+        # cache riêng từng máy -> LOCAL_RANK 0 của mỗi máy, cache trên ổ dùng chung (--shared_cache) -> rank 0
+        builder = not distributed or (is_main if args.shared_cache else int(os.environ.get("LOCAL_RANK", 0)) == 0)
+        if distributed:
+            if builder:
+                for is_train in (True, False):
+                    build_cache(args.data_path, is_train, args.cache_path, args.image_size, num_workers=args.num_workers)
+            dist.barrier()
+        # ảnh đã được resize sẵn trong cache, chỉ còn đổi kiểu + chuẩn hóa trên tensor uint8
+        cache_transform = transforms.Compose([
+            transforms.ConvertImageDtype(torch.float),
+            transforms.Normalize(MEAN, STD)
+        ])
+        train_dataset = CamXuc_cached_dataset(root=args.data_path, is_train=True, cache_path=args.cache_path,
+                                              image_size=args.image_size, transforms=cache_transform, build=builder)
+        val_dataset = CamXuc_cached_dataset(root=args.data_path, is_train=False, cache_path=args.cache_path,
+                                            image_size=args.image_size, transforms=cache_transform, build=builder)
+    else:
+        train_dataset = CamXuc_dataset(root=args.data_path, is_train=True, transforms=transform)
+        val_dataset = CamXuc_dataset(root=args.data_path, is_train=False, transforms=transform)
 
-    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=True, num_workers=4)
-    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False, num_workers=4)
+    pin_memory = device.type == "cuda"
+    train_sampler = DistributedSampler(train_dataset, shuffle=True) if distributed else None
+    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, shuffle=train_sampler is None,
+                              sampler=train_sampler, num_workers=args.num_workers, pin_memory=pin_memory)
+    # chia tập valid theo bước nhảy, không pad thêm mẫu trùng như DistributedSampler -> chỉ số chính xác sau khi reduce
+    val_subset = Subset(val_dataset, range(rank, len(val_dataset), world_size)) if distributed else val_dataset
+    val_loader = DataLoader(val_subset, batch_size=args.batch_size, shuffle=False,
+                            num_workers=args.num_workers, pin_memory=pin_memory)
+    num_classes = len(train_dataset.categories)
 
     criterion = nn.CrossEntropyLoss(label_smoothing=0.1)
     optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
@@ -71,81 +150,138 @@ def train(args):
 
     start_epoch = args.start_epoch
     if args.resume and os.path.isfile(args.resume):
-        print(f"🔁 Resume from {args.resume}")
+        if is_main:
+            print(f"🔁 Resume from {args.resume}")
         checkpoint = torch.load(args.resume, map_location=device)
         model.load_state_dict(checkpoint['model_state_dict'])
-        optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        # checkpoint export từ Features_EfNet_B2.py không có optimizer -> optimizer mới với --lr
+        if 'optimizer_state_dict' in checkpoint:
+            optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
         start_epoch = checkpoint['epoch'] + 1
 
-    if os.path.exists(args.log_path):
-        shutil.rmtree(args.log_path)
-    os.makedirs(args.log_path, exist_ok=True)
-    os.makedirs(args.checkpoint_path, exist_ok=True)
-    writer = SummaryWriter(args.log_path)
+    # chỉ rank 0 ghi TensorBoard và checkpoint
+    writer = None
+    if is_main:
+        if os.path.exists(args.log_path):
+            shutil.rmtree(args.log_path)
+        os.makedirs(args.log_path, exist_ok=True)
+        os.makedirs(args.checkpoint_path, exist_ok=True)
+        # TensorBoard + checkpoint được ghi ở thread nền, epoch sau chạy song song với I/O
+        writer = AsyncWriter(SummaryWriter(args.log_path), args.checkpoint_path, args.keep_last)
 
     best_accuracy = 0
+    global_step = 0
 
     for epoch in range(start_epoch, args.epochs):
         model.train()
-        train_correct = 0
-        total = 0
-        progress_bar = tqdm(train_loader, desc=f"Epoch {epoch}/{args.epochs}")
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
+        # các chỉ số được cộng dồn ngay trên device, chỉ đọc về host mỗi log_every step và cuối epoch
+        train_correct = torch.zeros((), dtype=torch.long, device=device)
+        train_loss = torch.zeros((), device=device)
+        total = torch.zeros((), dtype=torch.long, device=device)
+        progress_bar = tqdm(train_loader, desc=f"Epoch {epoch}/{args.epochs}", disable=not is_main)
+        optimizer.zero_grad(set_to_none=True)
+        epoch_start = window_start = time.perf_counter()
+        window_images = 0
 
-        for images, labels in progress_bar:
-            images, labels = images.to(device), labels.to(device)
-            outputs = model(images)
-            loss = criterion(outputs, labels)
+        for step, (images, labels) in enumerate(progress_bar):
+            images = images.to(device, non_blocking=True, memory_format=memory_format)
+            labels = labels.to(device, non_blocking=True)
+            is_update_step = (step + 1) % args.accum_steps == 0 or step + 1 == len(train_loader)
+            # khi tích lũy gradient, chỉ all-reduce gradient giữa các rank ở step cập nhật
+            sync_context = ddp_model.no_sync() if distributed and not is_update_step else nullcontext()
+            with sync_context:
+                with torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=amp_dtype is not None):
+                    outputs = train_model(images)
+                    loss = criterion(outputs, labels)
+                scaler.scale(loss / args.accum_steps).backward()
             preds = torch.argmax(outputs, dim=1)
-            train_correct += (preds == labels).sum().item()
+            train_correct += (preds == labels).sum()
+            train_loss += loss.detach()
             total += labels.size(0)
+            window_images += labels.size(0) * world_size
 
-            optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
+            if is_update_step:
+                scaler.step(optimizer)
+                scaler.update()
+                optimizer.zero_grad(set_to_none=True)
 
-            progress_bar.set_postfix(loss=loss.item())
+            global_step += 1
+            if is_main and global_step % args.log_every == 0:
+                loss_value = loss.item()
+                now = time.perf_counter()
+                writer.add_scalar("Train/Loss", loss_value, global_step)
+                writer.add_scalar("Train/ImagesPerSec", window_images / (now - window_start), global_step)
+                window_start, window_images = now, 0
+                progress_bar.set_postfix(loss=loss_value)
 
-        train_acc = train_correct / total
-        writer.add_scalar("Train/Accuracy", train_acc, epoch)
+        train_batches = torch.tensor(len(train_loader), device=device)
+        all_reduce(train_correct, train_loss, total, train_batches)
+        train_acc = train_correct.item() / total.item()
+        epoch_throughput = total.item() / (time.perf_counter() - epoch_start)
+        if is_main:
+            writer.add_scalar("Train/Accuracy", train_acc, epoch)
+            writer.add_scalar("Train/EpochLoss", train_loss.item() / train_batches.item(), epoch)
+            writer.add_scalar("Train/EpochImagesPerSec", epoch_throughput, epoch)
 
         # === VALIDATION ===
         model.eval()
-        val_loss = []
-        val_preds = []
-        val_labels = []
+        val_loss = torch.zeros((), device=device)
+        val_batches = torch.tensor(len(val_loader), device=device)
+        cm = torch.zeros((num_classes, num_classes), dtype=torch.long, device=device)
 
         with torch.no_grad():
             for images, labels in val_loader:
-                images, labels = images.to(device), labels.to(device)
-                outputs = model(images)
-                loss = criterion(outputs, labels)
+                images = images.to(device, non_blocking=True, memory_format=memory_format)
+                labels = labels.to(device, non_blocking=True)
+                with torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=amp_dtype is not None):
+                    outputs = eval_model(images)
+                    loss = criterion(outputs, labels)
                 preds = torch.argmax(outputs, dim=1)
+                # confusion matrix trên device: hàng = nhãn thật, cột = nhãn dự đoán
+                cm += torch.bincount(labels * num_classes + preds, minlength=num_classes ** 2).view(num_classes, num_classes)
+                val_loss += loss.float()
 
-                val_preds.extend(preds.cpu().numpy())
-                val_labels.extend(labels.cpu().numpy())
-                val_loss.append(loss.item())
-
-        val_acc = accuracy_score(val_labels, val_preds)
-        val_loss_mean = np.mean(val_loss)
-        writer.add_scalar("Val/Accuracy", val_acc, epoch)
-        writer.add_scalar("Val/Loss", val_loss_mean, epoch)
+        # cộng confusion matrix / loss của mọi rank -> mọi rank có cùng val_acc, val_loss (scheduler đồng bộ)
+        all_reduce(cm, val_loss, val_batches)
+        cm = cm.cpu().numpy()
+        val_acc = cm.trace() / max(cm.sum(), 1)
+        val_loss_mean = val_loss.item() / max(val_batches.item(), 1)
 
         scheduler.step(val_loss_mean)
 
-        print(f"[Epoch {epoch}] Train Acc: {train_acc:.4f} | Val Acc: {val_acc:.4f} | Val Loss: {val_loss_mean:.4f}")
+        if not is_main:
+            continue
 
-        cm = confusion_matrix(val_labels, val_preds)
-        plot_confusion_matrix(writer, cm, train_dataset.categories, epoch)
+        writer.add_scalar("Val/Accuracy", val_acc, epoch)
+        writer.add_scalar("Val/Loss", val_loss_mean, epoch)
+        print(f"[Epoch {epoch}] Train Acc: {train_acc:.4f} | Val Acc: {val_acc:.4f} | Val Loss: {val_loss_mean:.4f}"
+              f" | {epoch_throughput:.1f} img/s")
 
-        checkpoint = {
-            "epoch": epoch,
-            "model_state_dict": model.state_dict(),
-            "optimizer_state_dict": optimizer.state_dict()
-        }
-        torch.save(checkpoint, os.path.join(args.checkpoint_path, "last.pt"))
+        is_last_epoch = epoch + 1 == args.epochs
+        if (epoch + 1) % args.figure_every == 0 or is_last_epoch:
+            writer.add_figure('confusion_matrix', plot_confusion_matrix, cm, train_dataset.categories, step=epoch)
+
+        names = []
+        if (epoch + 1) % args.save_every == 0 or is_last_epoch:
+            names.append("last.pt")
+            if args.keep_last:
+                names.append(f"epoch_{epoch:03d}.pt")
         if val_acc > best_accuracy:
             best_accuracy = val_acc
-            torch.save(checkpoint, os.path.join(args.checkpoint_path, "best.pt"))
+            names.append("best.pt")
+        if names:
+            writer.save_checkpoint({
+                "epoch": epoch,
+                "model_state_dict": model.state_dict(),
+                "optimizer_state_dict": optimizer.state_dict()
+            }, names)
+
+    if writer is not None:
+        writer.close()
+    if distributed:
+        dist.destroy_process_group()
 
 if __name__ == "__main__":
     args = get_args()
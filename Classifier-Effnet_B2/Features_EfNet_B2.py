@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import argparse
+import itertools
+import numpy as np
+import torch
+import torch.nn as nn
+from torchvision.models import efficientnet_b2, EfficientNet_B2_Weights
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+from Dataset_CamXuc import CamXuc_dataset
+from Cache_CamXuc import fingerprint
+from Model_CamXuc import make_transform, build_effnet_b2, load_effnet_b2
+
+
+# Backbone EfficientNet-B2 đóng băng: chạy features + avgpool 1 lần trên dataset, lưu embedding 1408 chiều (float16, memmap)
+# Sau đó train / sweep head (Dropout + Linear giống model.classifier) trên ma trận này trong vài giây
+# và export head tốt nhất thành checkpoint giống best.pt
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Cache embedding của backbone EfficientNet-B2 và sweep classifier head")
+    parser.add_argument("--data_path", type=str, default="C:/Hoc_May/All_Project/Predict_CamXuc/dataset_classification")
+    parser.add_argument("--feature_path", type=str, default="C:/Hoc_May/All_Project/Predict_CamXuc/EfNet_checkpoint/features")
+    parser.add_argument("--backbone", type=str, default=None)  # best.pt đã fine-tune, None = trọng số ImageNet
+    parser.add_argument("--image_size", type=int, default=260)
+    parser.add_argument("--extract_batch", type=int, default=64)
+    parser.add_argument("--num_workers", type=int, default=4)
+    # === Sweep: mỗi tham số là danh sách cách nhau bởi dấu phẩy, chạy mọi tổ hợp ===
+    parser.add_argument("--lrs", type=str, default="1e-3,3e-3")
+    parser.add_argument("--label_smoothings", type=str, default="0,0.1")
+    parser.add_argument("--dropouts", type=str, default="0.3,0.5")
+    parser.add_argument("--class_weights", type=str, default="none,balanced")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--export", type=str, default=None)  # đường dẫn lưu checkpoint (giống best.pt) của head tốt nhất
+    return parser.parse_args()
+
+
+def load_backbone(path, device):
+    if path:
+        return load_effnet_b2(path, device)
+    return efficientnet_b2(weights=EfficientNet_B2_Weights.DEFAULT).to(device).eval()
+
+
+# === Cache embedding ===
+def extract_features(args, backbone, is_train, device):
+    split = "train" if is_train else "valid"
+    dataset = CamXuc_dataset(root=args.data_path, is_train=is_train, transforms=make_transform(args.image_size))
+    features_file = os.path.join(args.feature_path, f"{split}_features.npy")
+    labels_file = os.path.join(args.feature_path, f"{split}_labels.npy")
+    meta_file = os.path.join(args.feature_path, f"{split}_meta.json")
+    # cùng khóa với cache ảnh (đường dẫn, nhãn, kích thước, mtime từng file) + backbone
+    key = {"data": fingerprint(dataset, args.image_size),
+           "backbone": os.path.abspath(args.backbone) if args.backbone else "imagenet",
+           "backbone_mtime": os.path.getmtime(args.backbone) if args.backbone else None}
+    if all(os.path.isfile(f) for f in (features_file, labels_file, meta_file)):
+        with open(meta_file) as f:
+            if json.load(f) == key:
+                return np.load(features_file, mmap_mode="r"), np.load(labels_file)
+
+    os.makedirs(args.feature_path, exist_ok=True)
+    features = np.lib.format.open_memmap(features_file, mode="w+", dtype=np.float16,
+                                         shape=(len(dataset), backbone.classifier[1].in_features))
+    loader = DataLoader(dataset, batch_size=args.extract_batch, shuffle=False, num_workers=args.num_workers)
+    offset = 0
+    with torch.no_grad():
+        for images, _ in tqdm(loader, desc=f"Features {split}"):
+            # giống forward của EfficientNet nhưng dừng trước classifier
+            x = torch.flatten(backbone.avgpool(backbone.features(images.to(device))), 1)
+            features[offset:offset + len(x)] = x.float().cpu().numpy()
+            offset += len(x)
+    features.flush()
+    np.save(labels_file, np.asarray(dataset.labels, dtype=np.int64))
+    with open(meta_file, "w") as f:
+        json.dump(key, f, indent=2)
+    return np.load(features_file, mmap_mode="r"), np.load(labels_file)
+
+
+# === Train head ===
+def make_head(in_features, dropout, num_classes=8):
+    # cùng cấu trúc với efficientnet_b2().classifier -> state_dict ghép thẳng vào model đầy đủ
+    return nn.Sequential(nn.Dropout(p=dropout, inplace=True), nn.Linear(in_features, num_classes))
+
+
+def balanced_weights(labels, num_classes=8):
+    counts = torch.bincount(labels, minlength=num_classes).float()
+    return len(labels) / (num_classes * counts.clamp(min=1))
+
+
+def train_head(train_x, train_y, val_x, val_y, config, epochs, batch_size, device):
+    torch.manual_seed(0)
+    head = make_head(train_x.shape[1], config["dropout"]).to(device)
+    weight = balanced_weights(train_y).to(device) if config["class_weights"] == "balanced" else None
+    criterion = nn.CrossEntropyLoss(weight=weight, label_smoothing=config["label_smoothing"])
+    optimizer = torch.optim.Adam(head.parameters(), lr=config["lr"])
+    best = {"accuracy": -1.0, "epoch": -1, "state_dict": None}
+    for epoch in range(epochs):
+        head.train()
+        for idx in torch.randperm(len(train_x), device=device).split(batch_size):
+            loss = criterion(head(train_x[idx]), train_y[idx])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+        head.eval()
+        with torch.no_grad():
+            accuracy = (head(val_x).argmax(1) == val_y).float().mean().item()
+        if accuracy > best["accuracy"]:
+            best = {"accuracy": accuracy, "epoch": epoch,
+                    "state_dict": {k: v.detach().cpu().clone() for k, v in head.state_dict().items()}}
+    return best
+
+
+def export_checkpoint(backbone, head_state, path):
+    # checkpoint cùng định dạng best.pt: load được bởi Models_CamXuc / Quantize / Export_Onnx
+    # và --resume được trong EfficientNet_B2.py để fine-tune toàn bộ mạng từ epoch 0
+    # không lưu optimizer_state_dict: nếu có, resume sẽ lấy lr trong đó và bỏ qua --lr
+    model = build_effnet_b2()
+    state_dict = {k: v for k, v in backbone.state_dict().items() if not k.startswith("classifier.")}
+    state_dict.update({f"classifier.{k}": v for k, v in head_state.items()})
+    model.load_state_dict(state_dict)
+    checkpoint = {
+        "epoch": -1,
+        "model_state_dict": model.state_dict()
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    torch.save(checkpoint, path)
+    print(f"Đã lưu {path}")
+
+
+def main(args):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    backbone = load_backbone(args.backbone, device)
+    train_x, train_y = extract_features(args, backbone, True, device)
+    val_x, val_y = extract_features(args, backbone, False, device)
+    # ma trận embedding nhỏ (~N x 1408) -> đưa hết lên device 1 lần, mỗi cấu hình chỉ còn vài phép nhân ma trận
+    train_x = torch.from_numpy(np.asarray(train_x, dtype=np.float32)).to(device)
+    val_x = torch.from_numpy(np.asarray(val_x, dtype=np.float32)).to(device)
+    train_y, val_y = torch.from_numpy(train_y).to(device), torch.from_numpy(val_y).to(device)
+
+    grid = itertools.product(map(float, args.lrs.split(",")), map(float, args.label_smoothings.split(",")),
+                             map(float, args.dropouts.split(",")), args.class_weights.split(","))
+    results = []
+    for lr, label_smoothing, dropout, class_weights in grid:
+        config = {"lr": lr, "label_smoothing": label_smoothing, "dropout": dropout, "class_weights": class_weights}
+        t = time.perf_counter()
+        best = train_head(train_x, train_y, val_x, val_y, config, args.epochs, args.batch_size, device)
+        results.append({**config, "accuracy": best["accuracy"], "epoch": best["epoch"],
+                        "seconds": time.perf_counter() - t, "state_dict": best["state_dict"]})
+        print(f"lr={lr:g} smoothing={label_smoothing:g} dropout={dropout:g} weights={class_weights:<8} | "
+              f"Acc: {best['accuracy']:.4f} (epoch {best['epoch']}) | {results[-1]['seconds']:.1f}s")
+
+    results.sort(key=lambda r: r["accuracy"], reverse=True)
+    with open(os.path.join(args.feature_path, "sweep.json"), "w") as f:
+        json.dump([{k: v for k, v in r.items() if k != "state_dict"} for r in results], f, indent=2)
+    winner = results[0]
+    print(f"Tốt nhất: lr={winner['lr']:g} smoothing={winner['label_smoothing']:g} dropout={winner['dropout']:g} "
+          f"weights={winner['class_weights']} | Acc: {winner['accuracy']:.4f}")
+    if args.export:
+        export_checkpoint(backbone, winner["state_dict"], args.export)
+
+
+if __name__ == "__main__":
+    main(get_args())
@@ -0,0 +1,57 @@
+import time
+import torch
+import torch.nn as nn
+from torchvision import transforms
+from torchvision.models import efficientnet_b2, efficientnet_b0, mobilenet_v3_small
+
+
+# dùng chung cho train / quantize / distill / feature cache và script nhận diện: cùng kiến trúc, cùng tiền xử lý với best.pt
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+# student của Distill_EfNet_B2.py và kích thước input mặc định (thấp hơn 260 của B2)
+STUDENT_SIZES = {"mobilenet_v3_small": 160, "efficientnet_b0": 224}
+
+
+def make_transform(image_size):
+    return transforms.Compose([
+        transforms.Resize((image_size, image_size)),
+        transforms.ToTensor(),
+        transforms.Normalize(MEAN, STD)
+    ])
+
+
+def build_effnet_b2(num_classes=8, weights=None):
+    model = efficientnet_b2(weights=weights)
+    model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+    return model
+
+
+def build_student(arch, num_classes=8, weights=None):
+    # weights="DEFAULT": khởi tạo từ ImageNet khi distill, None khi chỉ load checkpoint
+    if arch == "mobilenet_v3_small":
+        model = mobilenet_v3_small(weights=weights)
+        model.classifier[3] = nn.Linear(model.classifier[3].in_features, num_classes)
+    elif arch == "efficientnet_b0":
+        model = efficientnet_b0(weights=weights)
+        model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+    else:
+        raise ValueError(f"Không có student {arch}, chọn một trong {list(STUDENT_SIZES)}")
+    return model
+
+
+def load_effnet_b2(path, device="cpu", num_classes=8):
+    model = build_effnet_b2(num_classes)
+    model.load_state_dict(torch.load(path, map_location=device)["model_state_dict"])
+    return model.to(device).eval()
+
+
+def latency_ms(model, image_size, batch_size, runs=30):
+    # đo trên CPU giống máy đầu cuối
+    x = torch.randn(batch_size, 3, image_size, image_size)
+    with torch.no_grad():
+        for _ in range(5):
+            model(x)
+        t = time.perf_counter()
+        for _ in range(runs):
+            model(x)
+    return (time.perf_counter() - t) / runs * 1000
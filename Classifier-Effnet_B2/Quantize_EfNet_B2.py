@@ -0,0 +1,108 @@
+import os
+import json
+import argparse
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Subset
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from sklearn.metrics import accuracy_score, confusion_matrix
+from tqdm import tqdm
+from Dataset_CamXuc import CamXuc_dataset
+from Model_CamXuc import make_transform, load_effnet_b2, latency_ms
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Lượng tử hóa tĩnh INT8 cho EfficientNet-B2 (FX graph mode)")
+    parser.add_argument("--data_path", type=str, default="C:/Hoc_May/All_Project/Predict_CamXuc/dataset_classification")
+    parser.add_argument("--checkpoint", type=str, default="C:/Hoc_May/All_Project/Predict_CamXuc/EfNet_checkpoint/efficientnet_b2/best.pt")
+    parser.add_argument("--output", type=str, default="C:/Hoc_May/All_Project/Predict_CamXuc/EfNet_checkpoint/efficientnet_b2/best_int8.pt")
+    parser.add_argument("--image_size", type=int, default=260)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--calib_samples", type=int, default=512)   # số ảnh valid dùng để calibrate
+    parser.add_argument("--max_acc_drop", type=float, default=0.01)  # sai khác accuracy tối đa cho phép so với FP32
+    parser.add_argument("--engine", type=str, default="x86", choices=["x86", "fbgemm", "qnnpack"])
+    parser.add_argument("--latency_threads", type=int, default=1)  # số thread CPU khi đo latency FP32 / INT8
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def evaluate(model, loader, desc):
+    preds, labels = [], []
+    with torch.no_grad():
+        for images, targets in tqdm(loader, desc=desc):
+            preds.append(torch.argmax(model(images), dim=1))
+            labels.append(targets)
+    preds, labels = torch.cat(preds).numpy(), torch.cat(labels).numpy()
+    # float(): tùy phiên bản sklearn, accuracy_score trả về np.float64 -> json.dump không ghi được
+    return float(accuracy_score(labels, preds)), confusion_matrix(labels, preds, labels=list(range(8)))
+
+
+def quantize(model, calib_loader, image_size, engine):
+    torch.backends.quantized.engine = engine
+    example_inputs = (torch.randn(1, 3, image_size, image_size),)
+    prepared = prepare_fx(model, get_default_qconfig_mapping(engine), example_inputs)
+    with torch.no_grad():
+        for images, _ in tqdm(calib_loader, desc="Calibrate"):
+            prepared(images)
+    return convert_fx(prepared)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    torch.manual_seed(args.seed)
+
+    val_dataset = CamXuc_dataset(root=args.data_path, is_train=False, transforms=make_transform(args.image_size))
+    calib_indices = torch.randperm(len(val_dataset))[:args.calib_samples].tolist()
+    calib_loader = DataLoader(Subset(val_dataset, calib_indices), batch_size=args.batch_size, num_workers=4)
+    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False, num_workers=4)
+
+    fp32_model = load_effnet_b2(args.checkpoint)
+    int8_model = quantize(load_effnet_b2(args.checkpoint), calib_loader, args.image_size, args.engine)
+
+    # === So sánh FP32 và INT8 trên toàn bộ tập valid ===
+    fp32_acc, fp32_cm = evaluate(fp32_model, val_loader, "FP32")
+    int8_acc, int8_cm = evaluate(int8_model, val_loader, "INT8")
+    recall = lambda cm: cm.diagonal() / np.maximum(cm.sum(axis=1), 1)
+    recall_delta = recall(int8_cm) - recall(fp32_cm)
+    drop = fp32_acc - int8_acc
+
+    print(f"FP32 Acc: {fp32_acc:.4f} | INT8 Acc: {int8_acc:.4f} | Drop: {drop:.4f} (max {args.max_acc_drop:.4f})")
+    for category, delta in zip(val_dataset.categories, recall_delta):
+        print(f"  {category:<10} recall delta: {delta:+.4f}")
+    print("Confusion matrix delta (INT8 - FP32):")
+    print(int8_cm - fp32_cm)
+
+    # === Latency CPU: SiLU / Sigmoid của EfficientNet vẫn chạy FP32 với qconfig mặc định,
+    # mỗi block có cặp quantize / dequantize -> tốc độ thực tế thấp hơn nhiều so với 2-4x lý thuyết ===
+    torch.set_num_threads(args.latency_threads)
+    latency = {}
+    for batch_size in (1, 4):
+        fp32_ms = latency_ms(fp32_model, args.image_size, batch_size)
+        int8_ms = latency_ms(int8_model, args.image_size, batch_size)
+        latency[f"batch{batch_size}"] = {"fp32_ms": fp32_ms, "int8_ms": int8_ms, "speedup": fp32_ms / int8_ms}
+        print(f"CPU ({args.latency_threads} thread) batch {batch_size}: FP32 {fp32_ms:.1f} ms | "
+              f"INT8 {int8_ms:.1f} ms | x{fp32_ms / int8_ms:.2f}")
+
+    report = {
+        "fp32_accuracy": fp32_acc,
+        "int8_accuracy": int8_acc,
+        "accuracy_drop": drop,
+        "max_acc_drop": args.max_acc_drop,
+        "recall_delta": dict(zip(val_dataset.categories, recall_delta.tolist())),
+        "fp32_confusion_matrix": fp32_cm.tolist(),
+        "int8_confusion_matrix": int8_cm.tolist(),
+        "latency_threads": args.latency_threads,
+        "latency": latency,
+        "accepted": bool(drop <= args.max_acc_drop),
+    }
+    with open(os.path.splitext(args.output)[0] + "_report.json", "w") as f:
+        json.dump(report, f, indent=2)
+
+    if drop > args.max_acc_drop:
+        raise SystemExit(f"❌ Bỏ model INT8: accuracy giảm {drop:.4f} > {args.max_acc_drop:.4f}")
+
+    # lưu dạng TorchScript để script nhận diện load trực tiếp, không cần dựng lại graph FX
+    scripted = torch.jit.trace(int8_model, torch.randn(1, 3, args.image_size, args.image_size))
+    torch.jit.save(scripted, args.output)
+    print(f"✅ Đã lưu model INT8: {args.output}")
@@ -0,0 +1,101 @@
+import io
+import os
+import queue
+import atexit
+import threading
+import torch
+
+
+# Ghi checkpoint + TensorBoard ở thread nền để epoch sau không phải chờ I/O:
+# - state_dict được copy sang CPU ngay trên thread train (đúng trạng thái cuối epoch), serialize + ghi file ở thread nền
+# - mỗi file được ghi ra file tạm rồi os.replace -> không bao giờ để lại last.pt / best.pt ghi dở
+# - hàng đợi có giới hạn: nếu thread nền chậm hơn, thread train chờ thay vì giữ quá nhiều bản snapshot trong RAM
+# - atexit flush hàng đợi khi thoát (kể cả khi train dừng vì exception)
+
+
+def snapshot(obj):
+    # copy mọi tensor sang CPU; trên CPU .cpu() không copy nên phải clone để optimizer step sau không ghi đè
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return obj
+
+
+def atomic_write(data, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class AsyncWriter:
+    # dùng thay SummaryWriter: add_scalar giữ nguyên chữ ký, thêm add_figure (render ở thread nền) và save_checkpoint
+    def __init__(self, writer, checkpoint_path, keep_last=0, queue_size=8):
+        self.writer = writer
+        self.checkpoint_path = checkpoint_path
+        self.keep_last = keep_last
+        self.history = []
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        # daemon: không chặn lúc thoát interpreter, việc flush do close() (atexit) đảm nhận
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            try:
+                job()
+            except Exception as e:
+                self.error = e
+
+    def _submit(self, job):
+        if self.error is not None:
+            raise RuntimeError("Lỗi khi ghi log / checkpoint ở thread nền") from self.error
+        if self.thread.is_alive():
+            self.queue.put(job)
+        else:
+            job()
+
+    def add_scalar(self, tag, value, step):
+        self._submit(lambda: self.writer.add_scalar(tag, value, step))
+
+    def add_figure(self, tag, render, *args, step):
+        # render(*args) trả về matplotlib.figure.Figure (không dùng pyplot -> an toàn khi gọi ngoài main thread)
+        self._submit(lambda: self.writer.add_figure(tag, render(*args), step, close=False))
+
+    def save_checkpoint(self, checkpoint, names):
+        # serialize 1 lần, ghi cùng nội dung ra mọi tên trong names (vd. last.pt, best.pt, epoch_012.pt)
+        checkpoint = snapshot(checkpoint)
+        self._submit(lambda: self._write_checkpoint(checkpoint, names))
+
+    def _write_checkpoint(self, checkpoint, names):
+        buffer = io.BytesIO()
+        torch.save(checkpoint, buffer)
+        data = buffer.getvalue()
+        for name in names:
+            atomic_write(data, os.path.join(self.checkpoint_path, name))
+        # chỉ giữ keep_last file epoch_XXX.pt mới nhất
+        self.history += [name for name in names if name.startswith("epoch_")]
+        while self.keep_last and len(self.history) > self.keep_last:
+            old_path = os.path.join(self.checkpoint_path, self.history.pop(0))
+            if os.path.exists(old_path):
+                os.remove(old_path)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+            self.writer.flush()
+            self.writer.close()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Lỗi khi ghi log / checkpoint ở thread nền") from error
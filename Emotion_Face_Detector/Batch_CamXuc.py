@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+
+import cv2
+import torch
+from tqdm import tqdm
+
+from Stages_CamXuc import emotion_labels, letterbox_frame, detect_faces, crop_faces, classify_crops
+from Models_CamXuc import add_model_args, load_models, report_first_prediction
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Nhận diện cảm xúc offline cho video / thư mục ảnh (không cần màn hình)")
+    add_model_args(parser)
+    parser.add_argument("sources", nargs="+", help="file video, URL rtsp://... hoặc thư mục ảnh")
+    parser.add_argument("--output", type=str, default="results.jsonl")  # .jsonl hoặc .parquet
+    parser.add_argument("--img_size", type=int, default=640)
+    parser.add_argument("--conf_thres", type=float, default=0.5)
+    parser.add_argument("--iou_thres", type=float, default=0.5)
+    parser.add_argument("--min_size", type=int, default=30)
+    parser.add_argument("--batch_size", type=int, default=8)    # số frame mỗi lần forward YOLO
+    parser.add_argument("--cls_batch", type=int, default=64)    # số khuôn mặt tối đa mỗi lần forward EfficientNet
+    parser.add_argument("--every", type=int, default=1)         # chỉ lấy mỗi frame thứ k
+    parser.add_argument("--start_frame", type=int, default=0)   # tiếp tục từ frame này của nguồn đầu tiên (resume)
+    parser.add_argument("--prefetch", type=int, default=32)
+    return parser.parse_args()
+
+
+# === Đọc frame: (nguồn, chỉ số frame, timestamp giây, ảnh BGR) ===
+def iter_images(path, every, start_frame):
+    files = sorted(f for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTS))
+    for index in range(start_frame, len(files), every):
+        image = cv2.imread(os.path.join(path, files[index]))
+        if image is not None:
+            yield files[index], index, None, image
+
+
+def iter_video(path, every, start_frame):
+    cap = cv2.VideoCapture(path)
+    index = 0
+    if start_frame and cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame):
+        index = start_frame
+    while True:
+        # grab() không decode nên bỏ qua frame rất rẻ
+        if not cap.grab():
+            break
+        if index >= start_frame and (index - start_frame) % every == 0:
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+            yield path, index, cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0, frame
+        index += 1
+    cap.release()
+
+
+def iter_source(source, every, start_frame):
+    if os.path.isdir(source):
+        return iter_images(source, every, start_frame)
+    return iter_video(source, every, start_frame)
+
+
+class Prefetcher:
+    # decode frame trong thread nền để CPU suy luận không phải chờ I/O
+    def __init__(self, sources, every, start_frame, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, args=(sources, every, start_frame), daemon=True)
+        self.thread.start()
+
+    def _run(self, sources, every, start_frame):
+        try:
+            # resume: chỉ nguồn đầu tiên (nơi lần chạy trước dừng lại) bắt đầu từ start_frame
+            for i, source in enumerate(sources):
+                for item in iter_source(source, every, start_frame if i == 0 else 0):
+                    self.queue.put(item)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.queue.put(None)
+
+    def batches(self, batch_size):
+        batch = []
+        while True:
+            item = self.queue.get()
+            if item is None:
+                if self.error is not None:
+                    raise RuntimeError("Lỗi khi đọc frame") from self.error
+                break
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+# === Ghi kết quả: JSONL hoặc Parquet (cần pyarrow) ===
+class ResultWriter:
+    def __init__(self, path, resume=False, flush_rows=10000):
+        self.path = path
+        self.parquet = path.endswith(".parquet")
+        self.rows = []
+        self.flush_rows = flush_rows
+        if self.parquet:
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise SystemExit("Cần cài pyarrow để ghi Parquet: pip install pyarrow")
+            self.pa, self.pq = pa, pq
+            self.writer = None
+            # schema cố định: timestamp của thư mục ảnh là null, của video là float -> không để pyarrow tự suy ra
+            self.schema = pa.schema([
+                ("source", pa.string()),
+                ("frame", pa.int64()),
+                ("timestamp", pa.float64()),
+                ("box", pa.list_(pa.int64())),
+                ("det_conf", pa.float64()),
+                ("emotion", pa.string()),
+                ("probs", pa.list_(pa.float64())),
+            ])
+            # Parquet không ghi nối được -> file đã có (vd. khi resume) thì ghi sang file part mới, không ghi đè
+            if os.path.exists(path):
+                base, ext = os.path.splitext(path)
+                part = 1
+                while os.path.exists(f"{base}.part{part}{ext}"):
+                    part += 1
+                self.path = f"{base}.part{part}{ext}"
+                print(f"{path} đã tồn tại, ghi kết quả vào {self.path}")
+        else:
+            # chỉ ghi nối khi resume (--start_frame > 0), chạy mới thì ghi đè -> không lặp lại dòng của lần chạy trước
+            self.file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def write(self, row):
+        if self.parquet:
+            self.rows.append(row)
+            if len(self.rows) >= self.flush_rows:
+                self.flush()
+        else:
+            self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        if not self.parquet or not self.rows:
+            return
+        table = self.pa.Table.from_pylist(self.rows, schema=self.schema)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, self.schema)
+        self.writer.write_table(table)
+        self.rows = []
+
+    def close(self):
+        if self.parquet:
+            self.flush()
+            if self.writer is not None:
+                self.writer.close()
+        else:
+            self.file.close()
+
+
+def process_batch(batch, yolo, eff_model, device, args):
+    frames = [item[3] for item in batch]
+    img_tensor = torch.cat([letterbox_frame(frame, args.img_size, device, auto=False) for frame in frames])
+    detections = detect_faces(yolo, img_tensor, [frame.shape for frame in frames],
+                              args.conf_thres, args.iou_thres, args.min_size)
+
+    # gom tất cả khuôn mặt của cả batch frame rồi phân loại theo khối cls_batch
+    crops = [crop_faces(frame, boxes, args.cls_size, device) for frame, boxes in zip(frames, detections)]
+    crops = torch.cat(crops)
+    probs = [classify_crops(eff_model, chunk)[2] for chunk in crops.split(args.cls_batch)] if len(crops) else []
+    probs = torch.cat(probs).cpu() if probs else None
+
+    rows = []
+    offset = 0
+    for (source, index, timestamp, _), boxes in zip(batch, detections):
+        if boxes is None or not len(boxes):
+            continue
+        for box in boxes.cpu().tolist():
+            p = probs[offset]
+            offset += 1
+            rows.append({
+                "source": source,
+                "frame": index,
+                "timestamp": timestamp,
+                "box": [int(v) for v in box[:4]],
+                "det_conf": round(box[4], 4),
+                "emotion": emotion_labels[int(p.argmax())],
+                "probs": [round(v, 4) for v in p.tolist()],
+            })
+    return rows
+
+
+def main(args):
+    device, yolo, eff_model = load_models(args)
+    prefetcher = Prefetcher(args.sources, args.every, args.start_frame, args.prefetch)
+    writer = ResultWriter(args.output, resume=args.start_frame > 0)
+
+    start = time.perf_counter()
+    frames = faces = 0
+    progress_bar = tqdm(prefetcher.batches(args.batch_size), unit="batch")
+    try:
+        for batch in progress_bar:
+            rows = process_batch(batch, yolo, eff_model, device, args)
+            report_first_prediction()
+            for row in rows:
+                writer.write(row)
+            frames += len(batch)
+            faces += len(rows)
+            progress_bar.set_postfix(frame=batch[-1][1], fps=f"{frames / (time.perf_counter() - start):.1f}")
+    finally:
+        # đóng file cả khi lỗi giữa chừng -> kết quả đã xử lý vẫn đọc được (Parquet cần footer)
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Xong {frames} frame, {faces} khuôn mặt trong {elapsed:.1f}s ({frames / max(elapsed, 1e-9):.1f} FPS) -> {writer.path}")
+
+
+if __name__ == "__main__":
+    main(get_args())
@@ -0,0 +1,218 @@
+import sys
+import json
+import time
+import argparse
+import platform
+
+import cv2
+import torch
+import numpy as np
+
+from Stages_CamXuc import letterbox_frame, postprocess_detections, crop_faces, classify_crops, draw_results
+from Models_CamXuc import add_model_args, load_models, STARTUP
+
+STAGES = ["letterbox", "yolo_forward", "nms_scale", "preprocess", "classifier", "draw"]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Benchmark từng stage của pipeline nhận diện cảm xúc (CPU, không cần camera / màn hình)")
+    add_model_args(parser)
+    parser.add_argument("--resolutions", type=str, default="640x480,1280x720,1920x1080")
+    parser.add_argument("--faces", type=str, default="0,1,5,20")
+    parser.add_argument("--clips", type=str, nargs="*", default=[])  # video quay sẵn, dùng box thật từ YOLO
+    parser.add_argument("--clip_frames", type=int, default=100)
+    parser.add_argument("--iters", type=int, default=50)
+    parser.add_argument("--bench_warmup", type=int, default=5)  # số frame chạy thử trước khi đo
+    parser.add_argument("--img_size", type=int, default=640)
+    parser.add_argument("--conf_thres", type=float, default=0.5)
+    parser.add_argument("--iou_thres", type=float, default=0.5)
+    parser.add_argument("--min_size", type=int, default=30)
+    parser.add_argument("--output", type=str, default="benchmark.json")
+    parser.add_argument("--baseline", type=str, default=None)      # file JSON của lần chạy trước để so sánh
+    parser.add_argument("--threshold", type=float, default=0.10)   # chậm hơn baseline quá 10% -> regression
+    parser.add_argument("--min_delta_ms", type=float, default=0.5)  # và chậm hơn quá 0.5 ms (bỏ qua nhiễu ở stage rất nhanh)
+    return parser.parse_args()
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux trả về KB, macOS trả về byte
+        return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+        except (ImportError, AttributeError):
+            return None
+
+
+def synthetic_frame(width, height, num_faces, seed=0):
+    # ảnh nhiễu + num_faces box xếp theo lưới, kích thước khuôn mặt giảm dần khi nhiều mặt
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    boxes = []
+    if num_faces:
+        cols = int(np.ceil(np.sqrt(num_faces)))
+        rows = int(np.ceil(num_faces / cols))
+        cell_w, cell_h = width // cols, height // rows
+        size = max(30, int(min(cell_w, cell_h) * 0.8))
+        for i in range(num_faces):
+            x1, y1 = (i % cols) * cell_w, (i // cols) * cell_h
+            boxes.append([x1, y1, min(width, x1 + size), min(height, y1 + size), 0.9, 0])
+    return frame, torch.tensor(boxes, dtype=torch.float32).view(-1, 6)
+
+
+def synthetic_predictions(boxes, frame_shape, img_shape, num_columns):
+    # box tổng hợp (tọa độ frame gốc) -> hàng output của YOLO (xywh trên ảnh letterbox, obj, ..., cls) để NMS + scale_coords
+    # được đo với đúng số khuôn mặt; ngược lại với scale_coords: nhân tỉ lệ letterbox rồi cộng phần pad
+    gain = min(img_shape[0] / frame_shape[0], img_shape[1] / frame_shape[1])
+    pad_x, pad_y = (img_shape[1] - frame_shape[1] * gain) / 2, (img_shape[0] - frame_shape[0] * gain) / 2
+    xyxy = boxes[:, :4] * gain + boxes.new_tensor([pad_x, pad_y, pad_x, pad_y])
+    rows = boxes.new_zeros((len(boxes), num_columns))
+    rows[:, :2] = (xyxy[:, :2] + xyxy[:, 2:]) / 2
+    rows[:, 2:4] = xyxy[:, 2:] - xyxy[:, :2]
+    rows[:, 4] = boxes[:, 4]
+    rows[:, -1] = 1.0  # xác suất lớp "face"; landmark = 0
+    return rows.unsqueeze(0)
+
+
+class Timer:
+    def __init__(self, device):
+        self.device = device
+        self.times = {stage: [] for stage in STAGES}
+
+    def measure(self, stage, fn, *args):
+        if self.device.type == "cuda":
+            torch.cuda.synchronize()
+        t = time.perf_counter()
+        result = fn(*args)
+        if self.device.type == "cuda":
+            torch.cuda.synchronize()
+        self.times[stage].append((time.perf_counter() - t) * 1000)
+        return result
+
+
+def run_frame(timer, frame, yolo, eff_model, device, args, synthetic_boxes=None):
+    img_tensor = timer.measure("letterbox", letterbox_frame, frame, args.img_size, device)
+    with torch.no_grad():
+        pred = timer.measure("yolo_forward", lambda x: yolo(x)[0], img_tensor)
+    # khung hình tổng hợp là nhiễu, YOLO không thấy mặt nào -> ghép box tổng hợp vào output của YOLO
+    # để NMS + scale_coords và các stage sau đều chạy với đúng số khuôn mặt
+    if synthetic_boxes is not None and len(synthetic_boxes):
+        rows = synthetic_predictions(synthetic_boxes, frame.shape, img_tensor.shape[2:], pred.shape[2])
+        pred = torch.cat([pred, rows.to(device=pred.device, dtype=pred.dtype)], dim=1)
+    boxes = timer.measure("nms_scale", postprocess_detections, pred, img_tensor.shape[2:], [frame.shape],
+                          args.conf_thres, args.iou_thres, args.min_size)[0]
+    # các stage sau luôn đo trên đúng box tổng hợp (không phụ thuộc --conf_thres / --min_size)
+    if synthetic_boxes is not None:
+        boxes = synthetic_boxes.to(device)
+    crops = timer.measure("preprocess", crop_faces, frame, boxes, args.cls_size, device)
+    labels, confs, _ = timer.measure("classifier", classify_crops, eff_model, crops)
+    timer.measure("draw", draw_results, frame.copy(), boxes, labels, confs)
+    return 0 if boxes is None else len(boxes)
+
+
+def summarize(timer, num_faces):
+    stages = {}
+    total = np.zeros(len(timer.times["letterbox"]))
+    for stage, values in timer.times.items():
+        values = np.array(values)
+        total += values
+        stages[stage] = {"mean": float(values.mean()), "p50": float(np.percentile(values, 50)),
+                         "p95": float(np.percentile(values, 95)), "p99": float(np.percentile(values, 99))}
+    stages["total"] = {"mean": float(total.mean()), "p50": float(np.percentile(total, 50)),
+                       "p95": float(np.percentile(total, 95)), "p99": float(np.percentile(total, 99))}
+    return {"faces": num_faces, "fps": 1000.0 / float(total.mean()), "stages": stages}
+
+
+def bench_synthetic(resolution, num_faces, yolo, eff_model, device, args):
+    width, height = map(int, resolution.split("x"))
+    frame, boxes = synthetic_frame(width, height, num_faces)
+    for _ in range(args.bench_warmup):
+        run_frame(Timer(device), frame, yolo, eff_model, device, args, boxes)
+    timer = Timer(device)
+    for _ in range(args.iters):
+        run_frame(timer, frame, yolo, eff_model, device, args, boxes)
+    return summarize(timer, num_faces)
+
+
+def bench_clip(path, yolo, eff_model, device, args):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < args.clip_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        return None
+    for frame in frames[:args.bench_warmup]:
+        run_frame(Timer(device), frame, yolo, eff_model, device, args)
+    timer = Timer(device)
+    faces = [run_frame(timer, frame, yolo, eff_model, device, args) for frame in frames]
+    result = summarize(timer, float(np.mean(faces)))
+    result["resolution"] = f"{frames[0].shape[1]}x{frames[0].shape[0]}"
+    return result
+
+
+def compare(results, baseline, threshold, min_delta_ms=0.5):
+    # regression khi p50 của 1 stage (hoặc total) chậm hơn baseline quá threshold và quá min_delta_ms,
+    # hoặc FPS giảm quá threshold. Stage chỉ mất vài micro giây (draw khi 0 khuôn mặt, classifier với batch rỗng)
+    # dao động tương đối rất lớn do nhiễu timer -> cần thêm ngưỡng tuyệt đối
+    regressions = []
+    for name, scenario in baseline["scenarios"].items():
+        current = results["scenarios"].get(name)
+        if current is None:
+            continue
+        for stage, stats in scenario["stages"].items():
+            if stage not in current["stages"]:
+                continue
+            p50 = current["stages"][stage]["p50"]
+            if p50 > stats["p50"] * (1 + threshold) and p50 - stats["p50"] > min_delta_ms:
+                regressions.append(f"{name} / {stage}: p50 {stats['p50']:.2f} -> {p50:.2f} ms")
+        if current["fps"] < scenario["fps"] * (1 - threshold):
+            regressions.append(f"{name}: FPS {scenario['fps']:.1f} -> {current['fps']:.1f}")
+    return regressions
+
+
+def main(args):
+    # trace + warm-up sẵn shape letterbox của từng độ phân giải tổng hợp
+    resolutions = [tuple(map(int, r.split("x")))[::-1] for r in args.resolutions.split(",")]
+    device, yolo, eff_model = load_models(args, resolutions)
+    results = {
+        "meta": {"torch": torch.__version__, "device": str(device), "backend": args.backend,
+                 "threads": torch.get_num_threads(), "platform": platform.platform()},
+        "scenarios": {},
+    }
+    for resolution in args.resolutions.split(","):
+        for num_faces in map(int, args.faces.split(",")):
+            name = f"synthetic_{resolution}_{num_faces}faces"
+            results["scenarios"][name] = bench_synthetic(resolution, num_faces, yolo, eff_model, device, args)
+            print(f"{name}: {results['scenarios'][name]['fps']:.1f} FPS")
+    for path in args.clips:
+        result = bench_clip(path, yolo, eff_model, device, args)
+        if result is not None:
+            results["scenarios"][f"clip_{path}"] = result
+            print(f"clip_{path}: {result['fps']:.1f} FPS ({result['faces']:.1f} khuôn mặt/frame)")
+    results["peak_rss_mb"] = peak_rss_mb()
+    results["startup"] = {k: v for k, v in STARTUP.items() if k != "start"}
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Đã ghi {args.output} (peak RSS: {results['peak_rss_mb']} MB)")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.min_delta_ms)
+        for line in regressions:
+            print(f"❌ {line}")
+        if regressions:
+            raise SystemExit(1)
+        print("✅ Không có regression so với baseline")
+
+
+if __name__ == "__main__":
+    main(get_args())
@@ -0,0 +1,55 @@
+import argparse
+import numpy as np
+import torch
+from Models_CamXuc import add_model_args, onnx_path, load_yolo, load_effnet, OrtModel, YoloExport, classifier_size
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Export YOLOv5-face và classifier cảm xúc sang ONNX (batch động)")
+    add_model_args(parser)
+    parser.add_argument("--img_size", type=int, default=640)   # kích thước vuông đầu vào YOLO
+    parser.add_argument("--opset", type=int, default=12)
+    parser.add_argument("--parity_batch", type=int, default=2)
+    parser.add_argument("--atol", type=float, default=1e-3)
+    parser.add_argument("--rtol", type=float, default=1e-3)
+    return parser.parse_args()
+
+
+def export(model, dummy, path, output_name, opset):
+    torch.onnx.export(model, dummy, path, opset_version=opset, do_constant_folding=True,
+                      input_names=["images"], output_names=[output_name],
+                      dynamic_axes={"images": {0: "batch"}, output_name: {0: "batch"}})
+    print(f"Đã export {path}")
+
+
+def check_parity(torch_model, onnx_file, sample, atol, rtol):
+    with torch.no_grad():
+        expected = torch_model(sample).numpy()
+    actual = OrtModel(onnx_file)(sample).numpy()
+    max_diff = np.abs(expected - actual).max()
+    ok = np.allclose(expected, actual, atol=atol, rtol=rtol)
+    print(f"{'OK  ' if ok else 'LỖI '} {onnx_file}: max |torch - onnx| = {max_diff:.6f}")
+    return ok
+
+
+if __name__ == "__main__":
+    args = get_args()
+    args.cls_size = classifier_size(args)
+    device = torch.device("cpu")
+    yolo_file = onnx_path(args.yolo_path, args.yolo_onnx)
+    effnet_file = onnx_path(args.effnet_path, args.effnet_onnx)
+
+    yolo = YoloExport(load_yolo(args.yolo_path, device)).eval()
+    eff_model = load_effnet(args.effnet_path, device, args.classifier)
+
+    export(yolo, torch.zeros(1, 3, args.img_size, args.img_size), yolo_file, "pred", args.opset)
+    export(eff_model, torch.zeros(1, 3, args.cls_size, args.cls_size), effnet_file, "logits", args.opset)
+
+    # === So khớp số học với PyTorch trên batch khác batch lúc export (kiểm tra trục batch động) ===
+    torch.manual_seed(0)
+    ok = check_parity(yolo, yolo_file, torch.rand(args.parity_batch, 3, args.img_size, args.img_size),
+                      args.atol, args.rtol)
+    ok &= check_parity(eff_model, effnet_file, torch.randn(args.parity_batch, 3, args.cls_size, args.cls_size),
+                       args.atol, args.rtol)
+    if not ok:
+        raise SystemExit("Kết quả ONNX lệch so với PyTorch")
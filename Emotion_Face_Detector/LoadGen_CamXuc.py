@@ -0,0 +1,79 @@
+import json
+import time
+import asyncio
+import argparse
+
+import cv2
+import numpy as np
+
+
+# client tạo tải cho Server_CamXuc.py: mở --concurrency kết nối keep-alive, gửi tổng cộng --requests request
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Load generator cho Server_CamXuc.py")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--endpoint", type=str, default="detect", choices=["detect", "classify"])
+    parser.add_argument("--image", type=str, default=None)  # None = ảnh nhiễu ngẫu nhiên
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    return parser.parse_args()
+
+
+def load_payload(path, endpoint):
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    size = (480, 640) if endpoint == "detect" else (260, 260)
+    image = np.random.default_rng(0).integers(0, 256, (*size, 3), dtype=np.uint8)
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+async def request(reader, writer, method, path, body=b""):
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n"
+                 f"Connection: keep-alive\r\n\r\n".encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, value = line.decode("latin-1").split(":", 1)
+        if key.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def worker(args, payload, counter, latencies, errors):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    while counter[0] < args.requests:
+        counter[0] += 1
+        t0 = time.perf_counter()
+        status, _ = await request(reader, writer, "POST", f"/{args.endpoint}", payload)
+        latencies.append(time.perf_counter() - t0)
+        if status != 200:
+            errors[0] += 1
+    writer.close()
+
+
+async def main(args):
+    payload = load_payload(args.image, args.endpoint)
+    counter, errors, latencies = [0], [0], []
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(args, payload, counter, latencies, errors) for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    lat = np.array(latencies) * 1000
+    print(f"{len(latencies)} request trong {elapsed:.2f}s -> {len(latencies) / elapsed:.1f} req/s, lỗi: {errors[0]}")
+    print(f"latency p50={np.percentile(lat, 50):.1f}ms p95={np.percentile(lat, 95):.1f}ms p99={np.percentile(lat, 99):.1f}ms")
+
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    _, metrics = await request(reader, writer, "GET", "/metrics")
+    writer.close()
+    print(json.dumps(metrics, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(get_args()))
@@ -0,0 +1,343 @@
+import os
+import sys
+import time
+import hashlib
+import threading
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from Stages_CamXuc import letterbox_shape  # import Stages_CamXuc đưa yolov5_face vào sys.path trước khi unpickle model YOLO
+
+# kiến trúc classifier (EfficientNet-B2 và các student) định nghĩa 1 lần trong Classifier-Effnet_B2/Model_CamXuc.py,
+# dùng chung với script train / distill (có thể đổi bằng biến môi trường CLASSIFIER_DIR)
+CLASSIFIER_DIR = os.environ.get("CLASSIFIER_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                               "Classifier-Effnet_B2"))
+if CLASSIFIER_DIR not in sys.path:
+    sys.path.append(CLASSIFIER_DIR)
+from Model_CamXuc import STUDENT_SIZES, build_effnet_b2, build_student  # noqa: E402
+
+
+# === Cấu hình đường dẫn ===
+YOLO_PATH = "C:/Hoc_May/All_Project/Predict_CamXuc/yolov5s-face.pt"
+EFFNET_PATH = "C:/Hoc_May/All_Project/Predict_CamXuc/EfNet_checkpoint/efficientnet_b2/best.pt"
+MODEL_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".model_cache")
+# kích thước đầu vào mặc định của từng classifier (student từ Distill_EfNet_B2.py chạy ở độ phân giải thấp hơn)
+CLASSIFIER_SIZES = {"effnet_b2": 260, **STUDENT_SIZES}
+
+
+# === Thời gian khởi động: tính từ lúc process bắt đầu tới dự đoán đầu tiên ===
+def process_start_time():
+    try:
+        import psutil
+        return psutil.Process().create_time()
+    except ImportError:
+        pass
+    try:
+        return os.stat(f"/proc/{os.getpid()}").st_ctime
+    except OSError:
+        return time.time()
+
+
+STARTUP = {"start": process_start_time()}
+
+
+def report_first_prediction():
+    # gọi sau mỗi lần dự đoán, chỉ in ở lần đầu tiên
+    if "first_prediction_s" in STARTUP:
+        return STARTUP["first_prediction_s"]
+    STARTUP["first_prediction_s"] = time.time() - STARTUP["start"]
+    print(f"⏱ Time-to-first-prediction: {STARTUP['first_prediction_s']:.2f}s "
+          f"(load {STARTUP.get('load_s', 0):.2f}s, warm-up {STARTUP.get('warmup_s', 0):.2f}s)")
+    return STARTUP["first_prediction_s"]
+
+
+def add_model_args(parser):
+    parser.add_argument("--yolo_path", type=str, default=YOLO_PATH)
+    parser.add_argument("--effnet_path", type=str, default=EFFNET_PATH)  # checkpoint classifier (teacher hoặc student)
+    parser.add_argument("--classifier", type=str, default="effnet_b2", choices=list(CLASSIFIER_SIZES))
+    parser.add_argument("--cls_size", type=int, default=None)  # mặc định: image_size trong checkpoint student, không thì 260 / 224 / 160
+    parser.add_argument("--device", type=str, default=None)  # mặc định: cuda nếu có, không thì cpu
+    parser.add_argument("--backend", type=str, default="torch", choices=["torch", "onnxruntime"])
+    parser.add_argument("--yolo_onnx", type=str, default=None)    # mặc định: cạnh file .pt, đuôi .onnx
+    parser.add_argument("--effnet_onnx", type=str, default=None)
+    parser.add_argument("--intra_threads", type=int, default=None)  # số thread trong 1 operator (mặc định của torch/ORT)
+    parser.add_argument("--inter_threads", type=int, default=1)     # > 1: chạy song song các nhánh graph
+    parser.add_argument("--effnet_int8", type=str, default=None)  # model INT8 (TorchScript) từ Quantize_EfNet_B2.py, chạy trên CPU
+    # === Khởi động nhanh ===
+    parser.add_argument("--model_cache", type=str, default=MODEL_CACHE)  # cache TorchScript đã fuse, "" = tắt
+    parser.add_argument("--lazy_load", action="store_true")   # load model ở thread nền, chỉ chờ khi cần dự đoán lần đầu
+    parser.add_argument("--warmup", type=int, default=1)      # số lần chạy thử trên input giả ngay sau khi load
+    return parser
+
+
+def onnx_path(pt_path, path=None):
+    return path or os.path.splitext(pt_path)[0] + ".onnx"
+
+
+def get_device(name=None):
+    if name:
+        return torch.device(name)
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def torch_load(path, device):
+    # memory-map file checkpoint khi được (torch >= 2.1, định dạng zip), không thì load bình thường
+    try:
+        return torch.load(path, map_location=device, mmap=True)
+    except (TypeError, RuntimeError):
+        return torch.load(path, map_location=device)
+
+
+# === Load YOLOv5-face ===
+def load_yolo(path, device):
+    return torch_load(path, device)['model'].float().fuse().eval().to(device)
+
+
+class YoloExport(nn.Module):
+    # chỉ giữ output đã decode (B, N, 16) = xywh, obj, 10 landmark, cls -> đưa thẳng vào non_max_suppression
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x)[0]
+
+
+# === Load classifier cảm xúc: EfficientNet-B2 hoặc student đã distill ===
+def build_classifier(arch, num_classes=8):
+    # weights=None: trọng số lấy từ checkpoint
+    return build_effnet_b2(num_classes) if arch == "effnet_b2" else build_student(arch, num_classes)
+
+
+def load_effnet(path, device, arch="effnet_b2", num_classes=8):
+    checkpoint = torch_load(path, device)
+    # checkpoint của student có lưu arch -> báo lỗi rõ ràng nếu --classifier không khớp
+    if checkpoint.get("arch", arch) != arch:
+        raise ValueError(f"{path} là checkpoint {checkpoint['arch']}, hãy chạy với --classifier {checkpoint['arch']}")
+    model = build_classifier(arch, num_classes)
+    model.load_state_dict(checkpoint["model_state_dict"])
+    return model.to(device).eval()
+
+
+def classifier_size(args):
+    # --cls_size > image_size lưu trong checkpoint student (Distill_EfNet_B2.py) > mặc định theo --classifier
+    if args.cls_size:
+        return args.cls_size
+    if args.classifier != "effnet_b2" and os.path.isfile(args.effnet_path):
+        return torch_load(args.effnet_path, "cpu").get("image_size", CLASSIFIER_SIZES[args.classifier])
+    return CLASSIFIER_SIZES[args.classifier]
+
+
+# === EfficientNet-B2 INT8 (TorchScript, chỉ chạy trên CPU) ===
+def load_effnet_int8(path):
+    return torch.jit.load(path, map_location="cpu").eval()
+
+
+def pad_to(x, input_hw, value):
+    # pad phải/dưới tới input_hw cố định -> không làm lệch tọa độ box
+    if input_hw and tuple(x.shape[2:]) != tuple(input_hw):
+        h, w = x.shape[2:]
+        if h > input_hw[0] or w > input_hw[1]:
+            raise ValueError(f"Input {h}x{w} lớn hơn kích thước cố định của model {input_hw[0]}x{input_hw[1]}")
+        x = F.pad(x, (0, input_hw[1] - w, 0, input_hw[0] - h), value=value)
+    return x
+
+
+# === Cache model đã fuse dạng TorchScript, khóa theo hash checkpoint + phiên bản torch ===
+# lần sau load thẳng TorchScript: không cần unpickle model YOLO (và code yolov5_face), không fuse, không dựng lại EfficientNet
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def cached_script(cache_dir, kind, checkpoint, device, example_shape, build):
+    key = f"{kind}-{file_hash(checkpoint)}-torch{torch.__version__}-{device.type}-{'x'.join(map(str, example_shape))}"
+    path = os.path.join(cache_dir, key.replace("+", "_") + ".ts")
+    if os.path.isfile(path):
+        return torch.jit.load(path, map_location=device).eval()
+    model = build()
+    example = torch.zeros(example_shape, device=device)
+    with torch.no_grad():
+        # chạy thử 1 lần trước khi trace (giống export.py của yolov5): Detect.forward dựng lại self.grid khi shape đổi,
+        # nếu không lần trace và lần check_trace ghi 2 graph khác nhau -> TracingCheckError
+        model(example)
+        scripted = torch.jit.trace(model, example)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.jit.save(scripted, tmp_path)
+    os.replace(tmp_path, path)
+    print(f"💾 Đã cache {kind} -> {path}")
+    return scripted.eval()
+
+
+class ShapeCachedModel:
+    # YOLO đã trace chỉ đúng với H, W lúc trace (grid của Detect được đóng băng) -> mỗi kích thước input 1 graph,
+    # cache riêng trên đĩa. Vd. frame letterbox 480x640 và ROI của tracker 256x256 chạy đúng kích thước của chúng,
+    # không bị pad lên img_size x img_size
+    def __init__(self, cache_dir, kind, checkpoint, device, build, sizes=()):
+        self.cache_dir = cache_dir
+        self.kind = kind
+        self.checkpoint = checkpoint
+        self.device = device
+        self.build = build
+        self.model = None  # model eager, chỉ load khi cần trace kích thước mới
+        self.graphs = {}
+        self.lock = threading.Lock()
+        for hw in sizes:
+            self.graph(hw)
+
+    def _build(self):
+        if self.model is None:
+            self.model = self.build()
+        return self.model
+
+    def graph(self, hw):
+        hw = tuple(hw)
+        with self.lock:
+            if hw not in self.graphs:
+                self.graphs[hw] = cached_script(self.cache_dir, self.kind, self.checkpoint, self.device,
+                                                (1, 3, *hw), self._build)
+            return self.graphs[hw]
+
+    def __call__(self, x):
+        return (self.graph(x.shape[2:])(x),)
+
+    def eval(self):
+        return self
+
+
+class LazyModel:
+    # load model ở thread nền, lần gọi đầu tiên mới chờ load xong
+    def __init__(self, loader):
+        self.model = None
+        self.error = None
+        self.thread = threading.Thread(target=self._load, args=(loader,), daemon=True)
+        self.thread.start()
+
+    def _load(self, loader):
+        try:
+            self.model = loader()
+        except Exception as e:
+            self.error = e
+
+    def get(self):
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.model
+
+    def __call__(self, x):
+        return self.get()(x)
+
+    def eval(self):
+        return self
+
+
+def warmup(yolo, eff_model, device, yolo_hws, cls_size=260, runs=1):
+    # chạy thử để cấp phát bộ nhớ và chọn kernel trước khi có frame thật, đúng các (H, W) YOLO sẽ nhận
+    with torch.no_grad():
+        for _ in range(runs):
+            for hw in yolo_hws:
+                yolo(torch.zeros(1, 3, *hw, device=device))
+            for batch in (1, 4):
+                eff_model(torch.zeros(batch, 3, cls_size, cls_size, device=device))
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+
+# === ONNX Runtime (CPU) ===
+class OrtModel:
+    # gọi giống nn.Module: nhận tensor, trả về tensor (hoặc tuple nếu as_tuple=True như output của YOLO)
+    # graph được export với H, W cố định -> input nhỏ hơn được pad phải/dưới bằng pad_to
+    def __init__(self, path, intra_threads=None, inter_threads=1, as_tuple=False, pad_value=0.0):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_threads:
+            options.intra_op_num_threads = intra_threads
+        options.inter_op_num_threads = inter_threads
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL if inter_threads > 1 else ort.ExecutionMode.ORT_SEQUENTIAL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_hw = tuple(model_input.shape[2:]) if all(isinstance(v, int) for v in model_input.shape[2:]) else None
+        self.as_tuple = as_tuple
+        self.pad_value = pad_value
+
+    def __call__(self, x):
+        x = pad_to(x, self.input_hw, self.pad_value)
+        outputs = self.session.run(None, {self.input_name: x.detach().cpu().float().numpy()})
+        outputs = tuple(torch.from_numpy(output).to(x.device) for output in outputs)
+        return outputs if self.as_tuple else outputs[0]
+
+    def eval(self):
+        return self
+
+
+def yolo_sizes(args, img_size, frame_shapes=()):
+    # các (H, W) YOLO chắc chắn sẽ nhận:
+    # - frame_shapes (H, W của nguồn) có sẵn: shape letterbox auto=True của từng nguồn (sync / pipeline / benchmark)
+    # - không có: img_size x img_size (batch nhiều frame với auto=False)
+    # - roi_size x roi_size cho ROI của tracker
+    sizes = [letterbox_shape(hw, img_size) for hw in frame_shapes] or [(img_size, img_size)]
+    if getattr(args, "track", False):
+        sizes.append((args.roi_size, args.roi_size))
+    return list(dict.fromkeys(sizes))
+
+
+def _load_torch_models(args, device, yolo_hws):
+    if args.model_cache:
+        # trace sẵn các kích thước đã biết, kích thước khác (vd. nguồn đổi độ phân giải) được trace + cache khi gặp lần đầu
+        yolo = ShapeCachedModel(args.model_cache, "yolo", args.yolo_path, device,
+                                lambda: YoloExport(load_yolo(args.yolo_path, device)).eval(), sizes=yolo_hws)
+    else:
+        yolo = load_yolo(args.yolo_path, device)
+    if args.effnet_int8:
+        eff_model = load_effnet_int8(args.effnet_int8)
+    elif args.model_cache:
+        eff_model = cached_script(args.model_cache, args.classifier, args.effnet_path, device,
+                                  (1, 3, args.cls_size, args.cls_size),
+                                  lambda: load_effnet(args.effnet_path, device, args.classifier))
+    else:
+        eff_model = load_effnet(args.effnet_path, device, args.classifier)
+    return yolo, eff_model
+
+
+def _load_and_warmup(args, device, yolo_hws):
+    t = time.perf_counter()
+    if args.backend == "onnxruntime":
+        # pad bằng màu xám 114 giống letterbox của YOLOv5
+        yolo = OrtModel(onnx_path(args.yolo_path, args.yolo_onnx), args.intra_threads, args.inter_threads,
+                        as_tuple=True, pad_value=114 / 255.0)
+        eff_model = OrtModel(onnx_path(args.effnet_path, args.effnet_onnx), args.intra_threads, args.inter_threads)
+    else:
+        yolo, eff_model = _load_torch_models(args, device, yolo_hws)
+    STARTUP["load_s"] = time.perf_counter() - t
+
+    if args.warmup:
+        t = time.perf_counter()
+        warmup(yolo, eff_model, device, yolo_hws, args.cls_size, runs=args.warmup)
+        STARTUP["warmup_s"] = time.perf_counter() - t
+    return yolo, eff_model
+
+
+def load_models(args, frame_shapes=()):
+    # frame_shapes: (H, W) của các nguồn đã biết trước, để trace + warm-up đúng shape letterbox auto=True
+    device = get_device(args.device)
+    yolo_hws = yolo_sizes(args, getattr(args, "img_size", 640), frame_shapes)
+    # các script crop khuôn mặt theo args.cls_size
+    args.cls_size = classifier_size(args)
+    if args.backend == "onnxruntime" or args.effnet_int8:
+        # ONNX Runtime (CPUExecutionProvider) và kernel quantized chỉ chạy trên CPU -> cả pipeline chạy trên CPU
+        device = torch.device("cpu")
+    if args.backend == "torch" and args.intra_threads:
+        torch.set_num_threads(args.intra_threads)
+    if args.lazy_load:
+        # load + warm-up ở thread nền trong lúc mở camera / server, lần dự đoán đầu tiên mới phải chờ
+        loader = LazyModel(lambda: _load_and_warmup(args, device, yolo_hws))
+        return device, LazyModel(lambda: loader.get()[0]), LazyModel(lambda: loader.get()[1])
+    yolo, eff_model = _load_and_warmup(args, device, yolo_hws)
+    return device, yolo, eff_model
@@ -0,0 +1,138 @@
+import time
+import argparse
+import threading
+
+import cv2
+import torch
+
+from Stages_CamXuc import letterbox_frame, detect_faces, crop_faces, classify_crops, draw_results
+from Models_CamXuc import add_model_args, load_models, report_first_prediction
+from Pipeline_CamXuc import FrameQueue
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Nhận diện cảm xúc cho nhiều camera / video trong 1 process, dùng chung model")
+    add_model_args(parser)
+    parser.add_argument("sources", nargs="+", help="chỉ số camera (0, 1, ...) hoặc đường dẫn video")
+    parser.add_argument("--img_size", type=int, default=640)
+    parser.add_argument("--conf_thres", type=float, default=0.5)
+    parser.add_argument("--iou_thres", type=float, default=0.5)
+    parser.add_argument("--min_size", type=int, default=30)
+    parser.add_argument("--max_batch", type=int, default=8)          # số frame tối đa mỗi lần forward YOLO
+    parser.add_argument("--per_stream_quota", type=int, default=1)   # số frame tối đa của 1 stream trong 1 batch
+    parser.add_argument("--queue_size", type=int, default=1)
+    parser.add_argument("--drop_policy", type=str, default="latest", choices=["latest", "block"])  # video file: dùng block
+    parser.add_argument("--show", action="store_true")               # mở cửa sổ cho từng stream
+    parser.add_argument("--report_every", type=float, default=5.0)
+    return parser.parse_args()
+
+
+class Stream:
+    def __init__(self, index, source, queue_size, drop_policy, stop_event):
+        self.index = index
+        self.name = f"{index}:{source}"
+        self.cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
+        self.queue = FrameQueue(queue_size, drop_policy)
+        self.stop_event = stop_event
+        self.done = False
+        self.read = 0
+        self.processed = 0
+        self.start = time.perf_counter()
+        self.thread = threading.Thread(target=self._reader, daemon=True)
+        self.thread.start()
+
+    def _reader(self):
+        while not self.stop_event.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            self.read += 1
+            self.queue.put(frame, self.stop_event)
+        self.done = True
+        self.cap.release()
+
+    def finished(self):
+        return self.done and not len(self.queue)
+
+    def summary(self):
+        fps = self.processed / max(time.perf_counter() - self.start, 1e-9)
+        return f"[{self.name}] {fps:.1f} FPS, đã xử lý {self.processed}/{self.read}, drop {self.queue.dropped}"
+
+
+class Scheduler:
+    # gom frame của mọi stream thành 1 batch YOLO và mọi khuôn mặt thành 1 batch EfficientNet
+    # công bằng: mỗi stream góp tối đa per_stream_quota frame / batch, thứ tự lấy xoay vòng qua các batch
+    # nên 1 stream bận không thể chiếm hết batch của các stream khác
+    def __init__(self, streams, yolo, eff_model, device, args):
+        self.streams = streams
+        self.yolo = yolo
+        self.eff_model = eff_model
+        self.device = device
+        self.args = args
+        self.offset = 0
+
+    def next_batch(self):
+        batch = []
+        n = len(self.streams)
+        for i in range(n):
+            stream = self.streams[(self.offset + i) % n]
+            for _ in range(self.args.per_stream_quota):
+                if len(batch) >= self.args.max_batch:
+                    break
+                frame = stream.queue.get(timeout=0)
+                if frame is None:
+                    break
+                batch.append((stream, frame))
+        self.offset = (self.offset + 1) % n
+        return batch
+
+    def process(self, batch):
+        frames = [frame for _, frame in batch]
+        img_tensor = torch.cat([letterbox_frame(frame, self.args.img_size, self.device, auto=False) for frame in frames])
+        detections = detect_faces(self.yolo, img_tensor, [frame.shape for frame in frames],
+                                  self.args.conf_thres, self.args.iou_thres, self.args.min_size)
+        crops = torch.cat([crop_faces(frame, boxes, self.args.cls_size, self.device) for frame, boxes in zip(frames, detections)])
+        labels, confs, _ = classify_crops(self.eff_model, crops)
+        offset = 0
+        for (stream, frame), boxes in zip(batch, detections):
+            count = 0 if boxes is None else len(boxes)
+            stream.processed += 1
+            if self.args.show:
+                draw_results(frame, boxes, labels[offset:offset + count], confs[offset:offset + count])
+                cv2.imshow(stream.name, frame)
+            offset += count
+
+
+def main(args):
+    device, yolo, eff_model = load_models(args)
+    stop_event = threading.Event()
+    streams = [Stream(i, source, args.queue_size, args.drop_policy, stop_event) for i, source in enumerate(args.sources)]
+    scheduler = Scheduler(streams, yolo, eff_model, device, args)
+
+    last_report = time.perf_counter()
+    try:
+        while not all(stream.finished() for stream in streams):
+            batch = scheduler.next_batch()
+            if not batch:
+                time.sleep(0.001)
+                continue
+            scheduler.process(batch)
+            report_first_prediction()
+            if args.show and cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+            now = time.perf_counter()
+            if args.report_every and now - last_report >= args.report_every:
+                for stream in streams:
+                    print(stream.summary())
+                last_report = now
+    finally:
+        stop_event.set()
+        for stream in streams:
+            stream.thread.join(timeout=1.0)
+            print(stream.summary())
+        if args.show:
+            cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    main(get_args())
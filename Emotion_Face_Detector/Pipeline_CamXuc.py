@@ -0,0 +1,190 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from Stages_CamXuc import letterbox_frame, detect_faces, classify_faces, draw_results
+from Tracker_CamXuc import FaceTracker
+from Models_CamXuc import report_first_prediction
+
+# đánh dấu hết nguồn: đi qua mọi stage sau frame cuối cùng để các stage xử lý nốt hàng đợi rồi mới dừng
+END_OF_STREAM = object()
+
+
+class FrameQueue:
+    # hàng đợi có giới hạn giữa 2 stage
+    # drop_policy="latest": đầy thì bỏ frame cũ nhất, frame mới nhất luôn thắng (độ trễ có giới hạn)
+    # drop_policy="block": đầy thì stage trước phải chờ (không mất frame)
+    def __init__(self, maxsize=1, drop_policy="latest"):
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+        self.items = deque()
+        self.cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item, stop_event):
+        with self.cond:
+            # END_OF_STREAM không bao giờ đẩy frame thật ra ngoài (vượt maxsize 1 phần tử cũng được)
+            while item is not END_OF_STREAM and len(self.items) >= self.maxsize:
+                if self.drop_policy == "latest":
+                    self.items.popleft()
+                    self.dropped += 1
+                    break
+                if stop_event.is_set():
+                    return
+                self.cond.wait(0.05)
+            self.items.append(item)
+            self.cond.notify_all()
+
+    def get(self, timeout=0.1):
+        with self.cond:
+            if not self.items:
+                self.cond.wait(timeout)
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    def __len__(self):
+        return len(self.items)
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.busy = 0.0
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.busy += seconds
+
+    def summary(self):
+        with self.lock:
+            elapsed = max(time.perf_counter() - self.start, 1e-9)
+            fps = self.count / elapsed
+            ms = self.busy / self.count * 1000 if self.count else 0.0
+        return f"{self.name}: {fps:.1f} FPS ({ms:.1f} ms/frame)"
+
+
+class Pipeline:
+    # capture -> detect -> classify -> render, mỗi stage chạy trong worker riêng, nối bằng FrameQueue
+    # render chạy ở main thread vì cv2.imshow không an toàn khi gọi từ thread khác
+    def __init__(self, cap, yolo, eff_model, device, args):
+        self.cap = cap
+        self.yolo = yolo
+        self.eff_model = eff_model
+        self.device = device
+        self.args = args
+        self.stop_event = threading.Event()
+        self.queues = {name: FrameQueue(args.queue_size, args.drop_policy) for name in ("detect", "classify", "render")}
+        self.stats = {name: StageStats(name) for name in ("capture", "detect", "classify", "render")}
+        self.latencies = deque(maxlen=300)
+        self.tracker = FaceTracker(yolo, eff_model, device, args) if args.track else None
+        self.error = None
+
+    def _guard(self, target, *args):
+        # lỗi trong worker (model, đường dẫn ONNX sai khi --lazy_load, ...) -> dừng cả pipeline, main thread báo lại
+        try:
+            target(*args)
+        except Exception as e:
+            self.error = e
+            self.stop_event.set()
+
+    def _capture(self):
+        frame_id = 0
+        while not self.stop_event.is_set():
+            t0 = time.perf_counter()
+            ret, frame = self.cap.read()
+            if not ret:
+                self.queues["detect"].put(END_OF_STREAM, self.stop_event)
+                return
+            self.stats["capture"].add(time.perf_counter() - t0)
+            self.queues["detect"].put({"id": frame_id, "t0": t0, "frame": frame}, self.stop_event)
+            frame_id += 1
+
+    def _worker(self, name, in_queue, out_queue, fn):
+        while not self.stop_event.is_set():
+            item = in_queue.get()
+            if item is None:
+                continue
+            if item is END_OF_STREAM:
+                out_queue.put(item, self.stop_event)
+                return
+            t = time.perf_counter()
+            fn(item)
+            self.stats[name].add(time.perf_counter() - t)
+            out_queue.put(item, self.stop_event)
+
+    def _detect(self, item):
+        frame = item["frame"]
+        if self.tracker:
+            # giữ box / ID của đúng frame này: khi classify tới lượt, thread detect có thể đã chạy tới frame sau
+            item["tracks"] = self.tracker.detect(frame, item["id"])
+            return
+        img_tensor = letterbox_frame(frame, self.args.img_size, self.device)
+        item["boxes"] = detect_faces(self.yolo, img_tensor, [frame.shape], self.args.conf_thres,
+                                     self.args.iou_thres, self.args.min_size)[0]
+
+    def _classify(self, item):
+        if self.tracker:
+            result = self.tracker.classify(item["frame"], item["id"], item["tracks"])
+            item["boxes"], item["labels"], item["confs"], item["ids"] = result
+            return
+        boxes = item["boxes"]
+        item["labels"] = item["confs"] = None
+        if boxes is not None and len(boxes):
+            item["labels"], item["confs"], _ = classify_faces(self.eff_model, item["frame"], boxes,
+                                                              self.args.cls_size, self.device)
+
+    def report(self):
+        lat = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        drops = ", ".join(f"{name}={q.dropped}" for name, q in self.queues.items())
+        stages = " | ".join(s.summary() for s in self.stats.values())
+        return (f"{stages} | e2e p50={np.percentile(lat, 50):.1f}ms p95={np.percentile(lat, 95):.1f}ms"
+                f" | drops: {drops}")
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self._guard, daemon=True, args=(self._capture,)),
+            threading.Thread(target=self._guard, daemon=True,
+                             args=(self._worker, "detect", self.queues["detect"], self.queues["classify"], self._detect)),
+            threading.Thread(target=self._guard, daemon=True,
+                             args=(self._worker, "classify", self.queues["classify"], self.queues["render"],
+                                   self._classify)),
+        ]
+        for thread in threads:
+            thread.start()
+
+        last_report = time.perf_counter()
+        while not self.stop_event.is_set():
+            item = self.queues["render"].get()
+            if item is None:
+                continue
+            if item is END_OF_STREAM:
+                break
+            t = time.perf_counter()
+            img0 = draw_results(item["frame"], item["boxes"], item["labels"], item["confs"], item.get("ids"))
+            report_first_prediction()
+            cv2.imshow("Nhận diện cảm xúc realtime", img0)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                self.stop_event.set()
+            now = time.perf_counter()
+            self.stats["render"].add(now - t)
+            self.latencies.append(now - item["t0"])
+            if self.args.report_every and now - last_report >= self.args.report_every:
+                print(self.report())
+                last_report = now
+
+        self.stop_event.set()
+        for thread in threads:
+            thread.join(timeout=1.0)
+        print(self.report())
+        if self.error is not None:
+            raise RuntimeError("Pipeline dừng do lỗi ở worker") from self.error
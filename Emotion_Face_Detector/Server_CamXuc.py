@@ -0,0 +1,239 @@
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import torch
+import numpy as np
+
+from Stages_CamXuc import emotion_labels, letterbox_frame, detect_faces, crop_faces, classify_crops
+from Models_CamXuc import add_model_args, load_models, report_first_prediction, STARTUP
+
+
+# API (localhost):
+#   POST /detect    body = ảnh đã encode (jpg/png) -> danh sách khuôn mặt: box, det_conf, emotion, probs
+#   POST /classify  body = ảnh khuôn mặt đã cắt sẵn -> emotion, probs
+#   GET  /metrics   độ sâu hàng đợi, histogram kích thước batch, latency p50/p95/p99
+#   GET  /health
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Server suy luận YOLOv5-face + EfficientNet-B2 với dynamic batching")
+    add_model_args(parser)
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max_batch", type=int, default=16)       # số request tối đa ghép thành 1 batch
+    parser.add_argument("--max_wait_ms", type=float, default=5.0)  # chờ tối đa để gom thêm request
+    parser.add_argument("--img_size", type=int, default=640)
+    parser.add_argument("--conf_thres", type=float, default=0.5)
+    parser.add_argument("--iou_thres", type=float, default=0.5)
+    parser.add_argument("--min_size", type=int, default=30)
+    return parser.parse_args()
+
+
+def decode_image(data):
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("không decode được ảnh")
+    return image
+
+
+def face_result(p):
+    return {"emotion": emotion_labels[int(p.argmax())], "probs": [round(v, 4) for v in p.tolist()]}
+
+
+class DynamicBatcher:
+    # gom các request đồng thời thành batch: chạy khi đủ max_batch hoặc request đầu tiên đã chờ max_wait_ms
+    # batch được chạy trong executor 1 thread -> event loop không bị chặn, model không bị gọi song song
+    def __init__(self, name, fn, executor, max_batch, max_wait_ms):
+        self.name = name
+        self.fn = fn
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = asyncio.Queue()
+        self.batch_sizes = Counter()
+        self.latencies = deque(maxlen=10000)
+        self.requests = 0
+        self.errors = 0
+
+    async def submit(self, payload):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((payload, future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            self.batch_sizes[len(batch)] += 1
+            try:
+                results = await loop.run_in_executor(self.executor, self.fn, [item[0] for item in batch])
+                report_first_prediction()
+            except Exception as e:
+                results = [e] * len(batch)
+            now = time.perf_counter()
+            for (_, future, t0), result in zip(batch, results):
+                self.requests += 1
+                self.latencies.append(now - t0)
+                if isinstance(result, Exception):
+                    self.errors += 1
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def metrics(self):
+        lat = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            "queue_depth": self.queue.qsize(),
+            "requests": self.requests,
+            "errors": self.errors,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            "latency_ms": {"p50": float(np.percentile(lat, 50)), "p95": float(np.percentile(lat, 95)),
+                           "p99": float(np.percentile(lat, 99))},
+        }
+
+
+class InferenceService:
+    def __init__(self, args):
+        self.args = args
+        self.device, self.yolo, self.eff_model = load_models(args)
+
+    def detect_batch(self, payloads):
+        # payloads: ảnh encode -> 1 forward YOLO cho cả batch + 1 forward EfficientNet cho mọi khuôn mặt
+        results = [None] * len(payloads)
+        frames, slots = [], []
+        for i, data in enumerate(payloads):
+            try:
+                frames.append(decode_image(data))
+                slots.append(i)
+            except ValueError as e:
+                results[i] = e
+        if not frames:
+            return results
+        args = self.args
+        img_tensor = torch.cat([letterbox_frame(frame, args.img_size, self.device, auto=False) for frame in frames])
+        detections = detect_faces(self.yolo, img_tensor, [frame.shape for frame in frames],
+                                  args.conf_thres, args.iou_thres, args.min_size)
+        crops = torch.cat([crop_faces(frame, boxes, args.cls_size, self.device) for frame, boxes in zip(frames, detections)])
+        probs = classify_crops(self.eff_model, crops)[2].cpu()
+        offset = 0
+        for slot, boxes in zip(slots, detections):
+            faces = []
+            for box in ([] if boxes is None else boxes.cpu().tolist()):
+                face = {"box": [int(v) for v in box[:4]], "det_conf": round(box[4], 4)}
+                face.update(face_result(probs[offset]))
+                faces.append(face)
+                offset += 1
+            results[slot] = {"faces": faces}
+        return results
+
+    def classify_batch(self, payloads):
+        results = [None] * len(payloads)
+        crops, slots = [], []
+        for i, data in enumerate(payloads):
+            try:
+                face = decode_image(data)
+            except ValueError as e:
+                results[i] = e
+                continue
+            full_box = torch.tensor([[0, 0, face.shape[1], face.shape[0]]], dtype=torch.float32)
+            crops.append(crop_faces(face, full_box, self.args.cls_size, self.device))
+            slots.append(i)
+        if crops:
+            probs = classify_crops(self.eff_model, torch.cat(crops))[2].cpu()
+            for slot, p in zip(slots, probs):
+                results[slot] = face_result(p)
+        return results
+
+
+# === HTTP/1.1 tối giản trên asyncio streams (không cần thư viện ngoài) ===
+async def read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, value = line.decode("latin-1").split(":", 1)
+        headers[key.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, path, headers, body
+
+
+def write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}[status]
+    writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                 .encode() + body)
+
+
+class Server:
+    def __init__(self, args):
+        self.args = args
+        self.service = InferenceService(args)
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.batchers = {
+            "/detect": DynamicBatcher("detect", self.service.detect_batch, executor, args.max_batch, args.max_wait_ms),
+            "/classify": DynamicBatcher("classify", self.service.classify_batch, executor, args.max_batch, args.max_wait_ms),
+        }
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "keep-alive").lower() != "close"
+                if method == "GET" and path == "/metrics":
+                    metrics = {name.strip("/"): b.metrics() for name, b in self.batchers.items()}
+                    metrics["startup"] = {k: v for k, v in STARTUP.items() if k != "start"}
+                    write_response(writer, 200, metrics, keep_alive)
+                elif method == "GET" and path == "/health":
+                    write_response(writer, 200, {"status": "ok"}, keep_alive)
+                elif method == "POST" and path in self.batchers:
+                    try:
+                        write_response(writer, 200, await self.batchers[path].submit(body), keep_alive)
+                    except ValueError as e:
+                        write_response(writer, 400, {"error": str(e)}, keep_alive)
+                    except Exception as e:
+                        write_response(writer, 500, {"error": str(e)}, keep_alive)
+                else:
+                    write_response(writer, 404, {"error": "not found"}, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        for batcher in self.batchers.values():
+            asyncio.create_task(batcher.run())
+        server = await asyncio.start_server(self.handle, self.args.host, self.args.port)
+        print(f"🚀 Server chạy tại http://{self.args.host}:{self.args.port} "
+              f"(max_batch={self.args.max_batch}, max_wait_ms={self.args.max_wait_ms})")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(Server(get_args()).serve())
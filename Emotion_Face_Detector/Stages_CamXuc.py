@@ -0,0 +1,128 @@
+import os
+import sys
+import cv2
+import torch
+import numpy as np
+from torchvision.ops import nms, roi_align
+
+# submodule yolov5_face nằm cạnh file này (có thể đổi bằng biến môi trường YOLOV5_FACE_DIR, tên thư mục bất kỳ,
+# vd. "yolov5-face" khi git clone). Code yolov5_face (và model YOLO đã pickle) import kiểu "from utils.xxx import ..."
+# / "models.yolo" nên chính thư mục đó phải nằm đầu sys.path
+YOLOV5_DIR = os.environ.get("YOLOV5_FACE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "yolov5_face"))
+if not os.path.isfile(os.path.join(YOLOV5_DIR, "utils", "datasets.py")):
+    raise ImportError(f"Không tìm thấy code yolov5-face tại {YOLOV5_DIR}: chạy 'git submodule update --init' "
+                      f"hoặc đặt YOLOV5_FACE_DIR trỏ tới thư mục đã clone")
+if YOLOV5_DIR not in sys.path:
+    sys.path.insert(0, YOLOV5_DIR)
+from utils.datasets import letterbox  # noqa: E402
+from utils.general import non_max_suppression, scale_coords  # noqa: E402
+
+
+# === Nhãn cảm xúc (Tiếng Việt nếu muốn) ===
+emotion_labels = ["Tuc Gian", "Khinh bi", "Kinh Tom", "So Hai", "Vui", "Binh Thuong", "Buon", "Ngac Nhien"]
+
+# === Chuẩn hóa giống transforms.Normalize lúc train EfficientNet-B2 ===
+MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+
+
+def letterbox_frame(frame, img_size=640, device="cpu", auto=True):
+    # auto=False cho ra ảnh vuông img_size x img_size để có thể ghép batch nhiều frame
+    img = letterbox(frame, new_shape=img_size, auto=auto)[0]
+    img = img[:, :, ::-1].transpose(2, 0, 1)
+    img = np.ascontiguousarray(img)
+    img_tensor = torch.from_numpy(img).to(device).float() / 255.0
+    return img_tensor.unsqueeze(0)
+
+
+def letterbox_shape(frame_hw, img_size=640):
+    # (H, W) mà letterbox_frame(auto=True) cho ra với frame kích thước frame_hw -> trace / warm-up sẵn đúng shape
+    return tuple(letterbox(np.zeros((*frame_hw, 3), dtype=np.uint8), new_shape=img_size, auto=True)[0].shape[:2])
+
+
+def detect_faces(yolo, img_tensor, frame_shapes, conf_thres=0.5, iou_thres=0.5, min_size=30):
+    # img_tensor: (B, 3, H, W), frame_shapes: shape của từng frame gốc -> list boxes (hoặc None) cho từng frame
+    with torch.no_grad():
+        pred = yolo(img_tensor)[0]
+    return postprocess_detections(pred, img_tensor.shape[2:], frame_shapes, conf_thres, iou_thres, min_size)
+
+
+def postprocess_detections(pred, img_shape, frame_shapes, conf_thres=0.5, iou_thres=0.5, min_size=30):
+    # NMS + đưa box về tọa độ frame gốc + lọc box nhỏ / trùng
+    preds = non_max_suppression(pred, conf_thres=conf_thres, iou_thres=iou_thres)
+    results = []
+    for det, frame_shape in zip(preds, frame_shapes):
+        if det is None or not len(det):
+            results.append(None)
+            continue
+        det[:, :4] = scale_coords(img_shape, det[:, :4], frame_shape).round()
+        results.append(filter_boxes(det, min_size=min_size, iou_thres=iou_thres))
+    return results
+
+
+def filter_boxes(pred, min_size=30, iou_thres=0.5):
+    # pred: (N, >=6) sau scale_coords, cột 0..3 là xyxy, cột 4 là conf
+    if pred is None or not len(pred):
+        return pred
+    pred = pred.clone()
+    pred[:, :4] = pred[:, :4].round()
+    wh = pred[:, 2:4] - pred[:, :2]
+    pred = pred[(wh >= min_size).all(dim=1)]
+    # thay vòng lặp O(n²) tính IoU bằng NMS của torchvision (cùng kết quả: giữ box conf cao, bỏ box IoU > iou_thres)
+    keep = nms(pred[:, :4], pred[:, 4], iou_thres)
+    return pred[keep]
+
+
+def frame_to_tensor(frame, device):
+    # frame BGR (H, W, 3) uint8 -> tensor RGB (1, 3, H, W) float, chưa chia 255
+    if isinstance(frame, torch.Tensor):
+        return frame.to(device)
+    tensor = torch.from_numpy(frame).to(device)
+    return tensor.permute(2, 0, 1).flip(0).unsqueeze(0).float()
+
+
+def crop_faces(frame, boxes, image_size=260, device="cpu"):
+    # cắt + resize + chuẩn hóa tất cả khuôn mặt trong 1 lần gọi roi_align, không qua PIL
+    if boxes is None or not len(boxes):
+        return torch.zeros((0, 3, image_size, image_size), device=device)
+    # chỉ đổi sang float vùng bao quanh các khuôn mặt (lề 1 px cho nội suy bilinear), không phải cả frame
+    rois = boxes[:, :4].detach().float().cpu()
+    h, w = frame.shape[-2:] if isinstance(frame, torch.Tensor) else frame.shape[:2]
+    x1, y1 = (max(0, int(v) - 1) for v in rois[:, :2].min(dim=0).values.floor().tolist())
+    x2, y2 = (min(limit, int(v) + 1) for v, limit in zip(rois[:, 2:].max(dim=0).values.ceil().tolist(), (w, h)))
+    region = frame[..., y1:y2, x1:x2] if isinstance(frame, torch.Tensor) else frame[y1:y2, x1:x2]
+    frame_tensor = frame_to_tensor(region, device)
+    rois = (rois - rois.new_tensor([x1, y1, x1, y1])).to(device=frame_tensor.device, dtype=frame_tensor.dtype)
+    crops = roi_align(frame_tensor, [rois], output_size=(image_size, image_size),
+                      spatial_scale=1.0, sampling_ratio=-1, aligned=True)
+    crops = crops / 255.0
+    return (crops - MEAN.to(crops.device)) / STD.to(crops.device)
+
+
+def classify_crops(model, crops):
+    # 1 lần forward cho cả batch khuôn mặt, trả về (nhãn, độ tin cậy softmax, xác suất)
+    if not len(crops):
+        empty = crops.new_zeros((0,))
+        return empty.long(), empty, crops.new_zeros((0, len(emotion_labels)))
+    with torch.no_grad():
+        probs = torch.softmax(model(crops), dim=1)
+    confs, labels = probs.max(dim=1)
+    return labels, confs, probs
+
+
+def classify_faces(model, frame, boxes, image_size=260, device="cpu"):
+    return classify_crops(model, crop_faces(frame, boxes, image_size, device))
+
+
+def draw_results(frame, boxes, labels, confs, track_ids=None):
+    if boxes is None or not len(boxes):
+        return frame
+    track_ids = track_ids or [None] * len(boxes)
+    for (x1, y1, x2, y2), label, conf, track_id in zip(boxes[:, :4].int().tolist(), labels.tolist(), confs.tolist(), track_ids):
+        emotion = emotion_labels[label]
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        label_text = f"{emotion} {conf*100:.2f}%"  # ← độ tin cậy softmax của từng khuôn mặt
+        if track_id is not None:
+            label_text = f"#{track_id} {label_text}"
+        cv2.putText(frame, label_text, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 255), 2)
+    return frame
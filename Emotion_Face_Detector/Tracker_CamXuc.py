@@ -0,0 +1,154 @@
+import threading
+import torch
+from torchvision.ops import box_iou
+from Stages_CamXuc import letterbox_frame, detect_faces, filter_boxes, classify_faces
+
+
+def add_tracker_args(parser):
+    parser.add_argument("--track", action="store_true")
+    parser.add_argument("--detect_every", type=int, default=5)     # chạy YOLO toàn khung hình mỗi N frame
+    parser.add_argument("--classify_every", type=int, default=10)  # phân loại lại cảm xúc mỗi track mỗi M frame
+    parser.add_argument("--ema", type=float, default=0.6)          # trọng số xác suất cũ khi làm mượt
+    parser.add_argument("--track_iou", type=float, default=0.3)
+    parser.add_argument("--max_misses", type=int, default=3)       # số lần detect toàn khung không thấy thì xóa track
+    parser.add_argument("--roi_margin", type=float, default=0.5)   # nới rộng box track khi tìm trong ROI
+    parser.add_argument("--roi_size", type=int, default=256)
+    return parser
+
+
+class Track:
+    def __init__(self, track_id, box, frame_idx):
+        self.id = track_id
+        self.box = box  # 1 hàng của pred: xyxy, conf, cls
+        self.probs = None
+        self.misses = 0
+        self.last_seen = frame_idx
+        self.last_classified = None
+
+
+class FaceTracker:
+    # tracker IoU/tâm box: giữ ID ổn định, chỉ chạy YOLO toàn khung hình mỗi detect_every frame
+    # (hoặc khi có track bị mất), các frame còn lại chỉ tìm trong ROI quanh các track đã biết
+    def __init__(self, yolo, eff_model, device, args):
+        self.yolo = yolo
+        self.eff_model = eff_model
+        self.device = device
+        self.args = args
+        self.tracks = []
+        self.next_id = 0
+        self.last_full = None
+        self.lock = threading.Lock()
+
+    def _match(self, boxes):
+        # ghép tham lam: ưu tiên IoU >= track_iou, sau đó tới khoảng cách tâm < nửa cạnh lớn của track
+        pairs = []
+        if not self.tracks or boxes is None or not len(boxes):
+            return pairs
+        track_boxes = torch.stack([t.box[:4] for t in self.tracks]).to(boxes.device)
+        iou = box_iou(track_boxes, boxes[:, :4])
+        track_centers = (track_boxes[:, :2] + track_boxes[:, 2:]) / 2
+        det_centers = (boxes[:, :2] + boxes[:, 2:4]) / 2
+        dist = torch.cdist(track_centers, det_centers)
+        limit = (track_boxes[:, 2:] - track_boxes[:, :2]).max(dim=1).values.unsqueeze(1) / 2
+        score = torch.where(iou >= self.args.track_iou, 1 + iou,
+                            torch.where(dist < limit, 1 - dist / limit, torch.zeros_like(iou)))
+        while len(pairs) < min(score.shape):
+            best = score.argmax()
+            t, d = divmod(best.item(), score.shape[1])
+            if score[t, d] <= 0:
+                break
+            pairs.append((t, d))
+            score[t, :] = 0
+            score[:, d] = 0
+        return pairs
+
+    def _update(self, boxes, frame_idx, full):
+        pairs = self._match(boxes)
+        matched_tracks = {t for t, _ in pairs}
+        matched_dets = {d for _, d in pairs}
+        for t, d in pairs:
+            track = self.tracks[t]
+            track.box = boxes[d]
+            track.misses = 0
+            track.last_seen = frame_idx
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+        if full:
+            # chỉ tạo track mới / xóa track cũ khi đã nhìn toàn khung hình
+            self.tracks = [t for t in self.tracks if t.misses <= self.args.max_misses]
+            if boxes is not None:
+                for d in range(len(boxes)):
+                    if d not in matched_dets:
+                        self.tracks.append(Track(self.next_id, boxes[d], frame_idx))
+                        self.next_id += 1
+
+    def _rois(self, frame_shape):
+        h, w = frame_shape[:2]
+        rois = []
+        for track in self.tracks:
+            x1, y1, x2, y2 = track.box[:4].tolist()
+            mx, my = (x2 - x1) * self.args.roi_margin, (y2 - y1) * self.args.roi_margin
+            rois.append((max(0, int(x1 - mx)), max(0, int(y1 - my)), min(w, int(x2 + mx)), min(h, int(y2 + my))))
+        return rois
+
+    def _detect_rois(self, frame, rois):
+        crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in rois]
+        img_tensor = torch.cat([letterbox_frame(crop, self.args.roi_size, self.device, auto=False) for crop in crops])
+        results = detect_faces(self.yolo, img_tensor, [crop.shape for crop in crops],
+                               self.args.conf_thres, self.args.iou_thres, self.args.min_size)
+        boxes = []
+        for (x1, y1, _, _), det in zip(rois, results):
+            if det is not None and len(det):
+                det[:, :4] += det.new_tensor([x1, y1, x1, y1])
+                boxes.append(det)
+        if not boxes:
+            return None
+        # các ROI chồng nhau có thể thấy cùng 1 khuôn mặt -> lọc trùng lại
+        return filter_boxes(torch.cat(boxes), self.args.min_size, self.args.iou_thres)
+
+    def detect(self, frame, frame_idx):
+        with self.lock:
+            full = (self.last_full is None or frame_idx - self.last_full >= self.args.detect_every
+                    or not self.tracks or any(t.misses > 0 for t in self.tracks))
+            rois = None if full else self._rois(frame.shape)
+        if full:
+            img_tensor = letterbox_frame(frame, self.args.img_size, self.device)
+            boxes = detect_faces(self.yolo, img_tensor, [frame.shape], self.args.conf_thres,
+                                 self.args.iou_thres, self.args.min_size)[0]
+        else:
+            boxes = self._detect_rois(frame, rois)
+        with self.lock:
+            if full:
+                self.last_full = frame_idx
+            self._update(boxes, frame_idx, full)
+            return self._snapshot()
+
+    def _snapshot(self):
+        # (track, box) của các track đang thấy tại frame vừa detect
+        return [(t, t.box) for t in self.tracks if t.misses == 0]
+
+    def classify(self, frame, frame_idx, visible=None):
+        # visible: snapshot trả về từ detect() của đúng frame này (pipeline: thread detect có thể đã chạy tới frame sau)
+        with self.lock:
+            if visible is None:
+                visible = self._snapshot()
+            due = [(t, box) for t, box in visible if t.last_classified is None
+                   or frame_idx - t.last_classified >= self.args.classify_every]
+            due_boxes = torch.stack([box for _, box in due]) if due else None
+        if due:
+            _, _, probs = classify_faces(self.eff_model, frame, due_boxes, self.args.cls_size, self.device)
+            with self.lock:
+                for (track, _), p in zip(due, probs):
+                    track.probs = p if track.probs is None else self.args.ema * track.probs + (1 - self.args.ema) * p
+                    track.last_classified = frame_idx
+        with self.lock:
+            visible = [(t, box, t.probs) for t, box in visible if t.probs is not None]
+        if not visible:
+            return None, None, None, None
+        boxes = torch.stack([box for _, box, _ in visible])
+        confs, labels = torch.stack([probs for _, _, probs in visible]).max(dim=1)
+        return boxes, labels, confs, [t.id for t, _, _ in visible]
+
+    def step(self, frame, frame_idx):
+        return self.classify(frame, frame_idx, self.detect(frame, frame_idx))